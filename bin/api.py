@@ -1,5 +1,22 @@
 #!/usr/bin/env python3
 
-import manage
+import sys
 
-manage.app().run(host='0.0.0.0', port=8083)
+try:
+    import gunicorn.app.wsgiapp
+except ImportError:
+    gunicorn = None
+
+if gunicorn is None or "--develop" in sys.argv[1:]:
+
+    import manage
+
+    manage.app().run(host='0.0.0.0', port=8083, threaded=True)
+
+else:
+
+    # The master never imports manage, only its worker does, which is what lets a reload pick up new code
+
+    sys.argv = [sys.argv[0], "--config", "python:serve", "manage:app()"]
+
+    gunicorn.app.wsgiapp.run()
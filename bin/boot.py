@@ -23,8 +23,11 @@ local.copy("requirements.txt", "requirements.txt")
 
 local.directory("lib")
 local.copy("lib/manage.py")
+local.copy("lib/serve.py")
 local.copy("lib/config.py")
 local.copy("lib/name.py")
+local.copy("lib/endpoint.py")
+local.copy("lib/store.py")
 
 local.directory("etc")
 local.copy("etc/nginx.conf")
@@ -29,11 +29,17 @@ for node in nodes:
     deploy = develop.Deploy(node, config["password"])
 
     deploy.update("klot-io-dns", "bin/dns.py")
+    deploy.update("klot-io-dns", "lib/endpoint.py")
     deploy.update("klot-io-dns", "lib/name.py")
     deploy.update("klot-io-daemon", "bin/daemon.py")
+    deploy.update("klot-io-daemon", "lib/endpoint.py")
+    deploy.update("klot-io-daemon", "lib/store.py")
     deploy.update("klot-io-daemon", "lib/config.py")
-    deploy.update("klot-io-api", "bin/api.py")
-    deploy.update("klot-io-api", "lib/manage.py")
+    deploy.update("klot-io-api", "bin/api.py", "reload-or-restart")
+    deploy.update("klot-io-api", "lib/serve.py", "reload-or-restart")
+    deploy.update("klot-io-api", "lib/endpoint.py", "reload-or-restart")
+    deploy.update("klot-io-api", "lib/store.py", "reload-or-restart")
+    deploy.update("klot-io-api", "lib/manage.py", "reload-or-restart")
     deploy.update("nginx", "www")
 
     deploy.close()
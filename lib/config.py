@@ -2,9 +2,17 @@ import os
 import time
 import copy
 import glob
+import json
+import random
+import select
+import struct
 import hashlib
+import threading
 
+import ctypes
+import ctypes.util
 import traceback
+import concurrent.futures
 
 import yaml
 import pykube
@@ -14,6 +22,9 @@ import netifaces
 import dbus
 import encodings.idna
 
+import store
+import endpoint
+
 
 WPA = """ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev
 update_config=1
@@ -37,6 +48,53 @@ RESOURCES = [
     "RoleBinding"
 ]
 
+# Kinds whose status says whether an installing app is ready, watched rather than polled
+
+READINESS = ["Job", "DaemonSet", "Deployment", "StatefulSet"]
+
+# Seconds to wait on an app's url before calling it not ready yet
+
+PROBE = 5
+
+# Lines of traceback kept on an app, the full one goes to the journal
+
+ERRORS = 10
+
+# Annotation holding the store digest of what we last applied, so fields dropped from a manifest get removed
+
+APPLIED = "klot.io/applied"
+
+# Fields the API server sets itself, which would otherwise always look changed
+
+MANAGED = ["uid", "resourceVersion", "generation", "creationTimestamp", "selfLink", "managedFields"]
+
+# Task name, seconds between runs when nothing triggers it, and random jitter added to that
+
+TASKS = [
+    ("boot", 60, 5),
+    ("configure", 60, 5),
+    ("uninitialized", 30, 10),
+    ("apps", 30, 5),
+    ("services", 60, 10),
+    ("clean", 60, 10)
+]
+
+WORKERS = 4
+
+# Manifests downloaded at once for a single app
+
+DOWNLOADS = 4
+
+LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+NOTIFY = {
+    "/boot/klot-io": "boot",
+    "/boot/klot-io/config": "boot",
+    "/boot/klot-io/lib": "boot",
+    "/opt/klot-io/config": "configure",
+    "/home/pi/.kube": "configure"
+}
+
 SERVER = """server {
 
     listen       %s;
@@ -54,6 +112,191 @@ SERVER = """server {
 class AppException(Exception):
     pass
 
+class Inotify(object):
+
+    # IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE from /usr/include/linux/inotify.h
+
+    MASK = 0x00000008 | 0x00000040 | 0x00000080 | 0x00000100 | 0x00000200
+    IGNORED = 0x00008000
+
+    def __init__(self):
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init()
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+        self.paths = {}
+
+    def add(self, path):
+
+        if path in self.paths.values():
+            return True
+
+        wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'), self.MASK)
+
+        if wd < 0:
+            return False
+
+        self.paths[wd] = path
+
+        return True
+
+    def read(self, timeout):
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        data = os.read(self.fd, 4096)
+        offset = 0
+        paths = []
+
+        while offset < len(data):
+
+            (wd, mask, cookie, length) = struct.unpack_from("iIII", data, offset)
+            offset += 16 + length
+
+            if wd not in self.paths:
+                continue
+
+            paths.append(self.paths[wd])
+
+            if mask & self.IGNORED:
+                del self.paths[wd]
+
+        return paths
+
+class Manifests(object):
+
+    def __init__(self, path="/opt/klot-io/cache/manifests", timeout=30):
+
+        self.path = path
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def write(self, path, content):
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+
+        with open(temporary, "w") as cache_file:
+            cache_file.write(content)
+
+        os.rename(temporary, path)
+
+    def cached(self, url):
+
+        meta_path = f"{self.path}/urls/{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+        if not os.path.exists(meta_path):
+            return None, None
+
+        with open(meta_path, "r") as meta_file:
+            meta = json.load(meta_file)
+
+        blob_path = f"{self.path}/blobs/{meta['digest']}"
+
+        if not os.path.exists(blob_path):
+            return None, None
+
+        with open(blob_path, "r") as blob_file:
+            return meta, blob_file.read()
+
+    def store(self, url, response):
+
+        digest = hashlib.sha256(response.text.encode('utf-8')).hexdigest()
+
+        if not os.path.exists(f"{self.path}/blobs/{digest}"):
+            self.write(f"{self.path}/blobs/{digest}", response.text)
+
+        self.write(f"{self.path}/urls/{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json", json.dumps({
+            "url": url,
+            "digest": digest,
+            "etag": response.headers.get("ETag"),
+            "modified": response.headers.get("Last-Modified")
+        }))
+
+    def get(self, url):
+
+        (meta, text) = self.cached(url)
+
+        headers = {}
+
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+
+        if meta and meta.get("modified"):
+            headers["If-Modified-Since"] = meta["modified"]
+
+        try:
+
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+
+        except requests.RequestException as exception:
+
+            if text is None:
+                raise
+
+            print(f"offline, using cached {url}: {exception}")
+            return 200, text
+
+        if response.status_code == 304 and text is not None:
+            print(f"not modified {url}")
+            return 200, text
+
+        if response.status_code == 200:
+            self.store(url, response)
+
+        return response.status_code, response.text
+
+class Scheduler(object):
+
+    def __init__(self, daemon, tasks):
+
+        self.daemon = daemon
+        self.tasks = tasks
+
+        self.condition = threading.Condition()
+        self.due = {name: 0 for name, interval, jitter in tasks}
+
+    def trigger(self, name, delay=0.05):
+
+        with self.condition:
+            self.due[name] = min(self.due[name], time.time() + delay)
+            self.condition.notify()
+
+    def next(self):
+
+        with self.condition:
+
+            while True:
+
+                now = time.time()
+                due = [(name, interval, jitter) for name, interval, jitter in self.tasks if self.due[name] <= now]
+
+                if due:
+                    for name, interval, jitter in due:
+                        self.due[name] = now + interval + random.uniform(0, jitter)
+                    return [name for name, interval, jitter in due]
+
+                self.condition.wait(min(self.due.values()) - now)
+
+    def run(self):
+
+        while True:
+
+            for name in self.next():
+
+                try:
+
+                    getattr(self.daemon, name)()
+
+                except Exception as exception:
+
+                    traceback.print_exc()
+
 class Daemon(object):
 
     def __init__(self):
@@ -66,6 +309,23 @@ class Daemon(object):
        self.node = None
        self.cnames = set()
 
+       self.lock = threading.Lock()
+       self.index = endpoint.Index()
+       self.listed = set()
+       self.watches = {}
+       self.scheduler = Scheduler(self, TASKS)
+
+       self.ready = {}
+       self.tracked = {}
+       self.requires = {}
+
+       self.acting = threading.Lock()
+       self.backoffs = {}
+       self.workers = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS)
+       self.downloads = concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOADS)
+       self.manifests = Manifests()
+       self.store = store.Store()
+
     def execute(self, command):
 
         print(command)
@@ -442,12 +702,12 @@ class Daemon(object):
 
         print(f"requesting {url}")
 
-        response = requests.get(url)
+        (status_code, text) = self.manifests.get(url)
 
-        if response.status_code != 200:
-            raise Exception(f"error from source {source} url: {url} - {response.status_code}: {response.text}")
+        if status_code != 200:
+            raise Exception(f"error from source {source} url: {url} - {status_code}: {text}")
 
-        return response.text
+        return text
 
     def discover(self, name, source, action):
 
@@ -476,7 +736,7 @@ class Daemon(object):
 
         print(f"defining {obj['metadata']['name']} from {obj['source']}")
 
-        definition = yaml.safe_load(self.manifest(obj['source']))
+        definition = yaml.load(self.manifest(obj['source']), Loader=LOADER)
 
         if not isinstance(definition, dict):
             raise Exception(f"source {obj['source']} produced non dict {definition}")
@@ -495,31 +755,61 @@ class Daemon(object):
 
     def act(self, name, action):
 
-        obj = pykube.KlotIOApp.objects(self.kube).get(name=name).obj
+        with self.acting:
 
-        if obj.get("action", "Preview") == "Install" and action == "Preview":
-            return
+            obj = pykube.KlotIOApp.objects(self.kube).get(name=name).obj
+
+            if obj.get("action", "Preview") == "Install" and action == "Preview":
+                return
 
-        print(f"setting {name} for {action}")
+            print(f"setting {name} for {action}")
 
-        obj["action"] = action
+            original = copy.deepcopy(obj)
+            obj["action"] = action
 
-        pykube.KlotIOApp(self.kube, obj).replace()
+            store.save(self.kube, original, obj)
 
-    def download(self, obj):
+    def parse(self, source):
+
+        return list(yaml.load_all(self.manifest(source), Loader=LOADER))
+
+    def fetch(self, obj):
 
         print(f"downloading {obj['metadata']['name']} from {obj['source']}")
 
-        obj["resources"] = []
+        futures = [self.downloads.submit(self.parse, {**obj["source"], **manifest}) for manifest in obj["spec"]["manifests"]]
+
+        resources = []
+
+        # Collected in manifest order so the stable sort below always gives the same result
+
+        for future in futures:
+            resources.extend(future.result())
+
+        resources.sort(key= lambda resource: RESOURCES.index(resource["kind"]) if resource["kind"] in RESOURCES else len(RESOURCES))
+
+        return resources
+
+    def resources(self, obj):
+
+        # Apps downloaded before the store kept their resources inline
+
+        if isinstance(obj["resources"], list):
+            return obj["resources"]
+
+        resources = self.store.get(obj["resources"])
+
+        # The store is on the master's disk, so a rebuilt master has to download again
 
-        for manifest in obj["spec"]["manifests"]:
+        if resources is None:
+            resources = self.fetch(obj)
+            obj["resources"] = self.store.put(resources)
 
-            source = copy.deepcopy(obj["source"])
-            source.update(manifest)
+        return resources
 
-            obj["resources"].extend(list(yaml.safe_load_all(self.manifest(source))))
+    def download(self, obj):
 
-        obj["resources"].sort(key= lambda resource: RESOURCES.index(resource["kind"]) if resource["kind"] in RESOURCES else len(RESOURCES))
+        obj["resources"] = self.store.put(self.fetch(obj))
         obj["status"] = "Downloaded"
 
         for app in obj["spec"].get("requires", []):
@@ -550,11 +840,164 @@ class Daemon(object):
             "data": {"settings.yaml": yaml.safe_dump(obj["settings"])}
         }
 
+        self.apply([obj])
+
+    def desired(self, resource):
+
+        desired = copy.deepcopy(resource)
+        desired.pop("status", None)
+
+        for field in MANAGED:
+            desired["metadata"].pop(field, None)
+
+        # The whole manifest could blow the 256 KiB annotation limit, so it goes in the store
+
+        annotations = desired["metadata"].setdefault("annotations", {})
+        annotations.pop(APPLIED, None)
+        annotations[APPLIED] = self.store.put(desired)
+
+        return desired
+
+    def applied(self, actual):
+
+        annotation = actual["metadata"].get("annotations", {}).get(APPLIED)
+
+        if not annotation:
+            return {}
+
+        if annotation.startswith("{"):
+            return json.loads(annotation)
+
+        return self.store.get(annotation) or {}
+
+    @staticmethod
+    def builtin(resource):
+
+        # Strategic merge keeps server assigned list entries, like a Service's nodePort, but CRDs don't support it
+
+        group = resource["apiVersion"].rpartition("/")[0]
+
+        return "." not in group or group.endswith(".k8s.io")
+
+    @staticmethod
+    def immutable(response):
+
         try:
-            pykube.ConfigMap(self.kube, obj).replace()
-        except pykube.PyKubeError:
-            pykube.ConfigMap(self.kube, obj).delete()
-            pykube.ConfigMap(self.kube, obj).create()
+            status = response.json()
+        except ValueError:
+            return False
+
+        # Only a forbidden or immutable field needs recreating, anything else is a bad manifest
+
+        causes = status.get("details", {}).get("causes", [])
+
+        return any(
+            cause.get("reason") == "FieldValueForbidden" or "immutable" in cause.get("message", "")
+            for cause in causes
+        ) or "immutable" in status.get("message", "")
+
+    @classmethod
+    def drifted(cls, desired, actual):
+
+        # Only what the manifest says matters, anything else live was defaulted by the server
+
+        if isinstance(desired, dict):
+            return not isinstance(actual, dict) or any(cls.drifted(value, actual.get(key)) for key, value in desired.items())
+
+        if isinstance(desired, list):
+            return (
+                not isinstance(actual, list) or len(desired) != len(actual) or
+                any(cls.drifted(value, actual[index]) for index, value in enumerate(desired))
+            )
+
+        return desired != actual
+
+    @classmethod
+    def removed(cls, applied, desired):
+
+        patch = dict(desired)
+
+        for key, value in applied.items():
+            if key not in desired:
+                patch[key] = None
+            elif isinstance(value, dict) and isinstance(desired[key], dict):
+                patch[key] = cls.removed(value, desired[key])
+
+        return patch
+
+    def live(self, resources):
+
+        live = {}
+
+        for resource in resources:
+
+            Resource = getattr(pykube, resource["kind"])
+            namespace = Resource(self.kube, resource).namespace
+
+            if (resource["kind"], namespace) in live:
+                continue
+
+            # One list per kind and namespace rather than a get per resource
+
+            try:
+                objs = [obj.obj for obj in Resource.objects(self.kube, namespace=namespace).filter()]
+                live[(resource["kind"], namespace)] = {obj["metadata"]["name"]: obj for obj in objs}
+            except pykube.PyKubeError as exception:
+                print(f"failed to list {resource['kind']}: {exception}")
+                live[(resource["kind"], namespace)] = None
+
+        return live
+
+    def apply(self, resources):
+
+        live = self.live(resources)
+
+        for resource in resources:
+
+            desired = self.desired(resource)
+            Resource = getattr(pykube, desired["kind"])
+            current = Resource(self.kube, desired)
+            objs = live[(desired["kind"], current.namespace)]
+
+            if objs is not None:
+                actual = objs.get(desired["metadata"]["name"])
+            elif current.exists():
+                current.reload()
+                actual = current.obj
+            else:
+                actual = None
+
+            if actual is None:
+                print(f"creating {self.display(desired)}")
+                Resource(self.kube, desired).create()
+                continue
+
+            if not self.drifted(desired, actual):
+                print(f"unchanged {self.display(desired)}")
+                continue
+
+            applied = self.applied(actual)
+
+            print(f"patching {self.display(desired)}")
+
+            if self.builtin(desired):
+                content = "application/strategic-merge-patch+json"
+            else:
+                content = "application/merge-patch+json"
+
+            response = self.kube.patch(**current.api_kwargs(
+                headers={"Content-Type": content},
+                data=json.dumps(self.removed(applied, desired))
+            ))
+
+            # Immutable fields, like a Job's template, can only change by recreating
+
+            if response.status_code == 422 and self.immutable(response):
+                print(f"recreating {self.display(desired)}")
+                Resource(self.kube, desired).delete()
+                Resource(self.kube, desired).create()
+            else:
+                self.kube.raise_for_status(response)
 
     def create(self, obj):
 
@@ -575,14 +1018,7 @@ class Daemon(object):
 
         print(f"creating {obj['metadata']['name']}")
 
-        for resource in obj["resources"]:
-            print(f"applying {self.display(resource)}")
-            Resource = getattr(pykube, resource["kind"])
-            try:
-                Resource(self.kube, resource).replace()
-            except pykube.PyKubeError:
-                Resource(self.kube, resource).delete()
-                Resource(self.kube, resource).create()
+        self.apply(self.resources(obj))
 
         if "settings" in obj:
             self.settings(obj)
@@ -602,42 +1038,66 @@ class Daemon(object):
 
         return url
 
-    def check(self, obj):
+    @staticmethod
+    def readiness(kind, obj):
 
-        print(f"checking {obj['metadata']['name']}")
+        status = obj.get("status", {})
 
-        url = None
+        if kind == "Job":
+            return (1, status.get("succeeded", 0))
 
-        for resource in obj["resources"]:
+        if kind == "DaemonSet":
+            return (status.get("desiredNumberScheduled", 0), status.get("numberReady", 0))
 
-            print(f"checking {self.display(resource)} status")
+        return (status.get("replicas", 0), status.get("readyReplicas", 0))
 
-            check = getattr(pykube, resource["kind"])(self.kube, resource)
+    def identify(self, resource):
 
-            try:
-                check.reload()
-            except pykube.PyKubeError:
-                print(f"failed to reload {self.display(resource)}")
-                return False
+        Resource = getattr(pykube, resource["kind"])
 
-            if resource["kind"] == "Job":
+        return (resource["kind"], Resource(self.kube, resource).namespace, resource["metadata"]["name"])
 
-                expected = 1
-                actual = check.obj.get("status", {}).get("succeeded", 0)
+    def status(self, resource):
 
-            elif resource["kind"] == "DaemonSet":
+        key = self.identify(resource)
 
-                expected = check.obj.get("status", {}).get("desiredNumberScheduled", 0)
-                actual = check.obj.get("status", {}).get("numberReady", 0)
+        with self.lock:
 
-            elif resource["kind"] == "Deployment":
+            if resource["kind"] in self.listed:
+                return self.ready.get(key)
 
-                expected = check.obj.get("status", {}).get("replicas", 0)
-                actual = check.obj.get("status", {}).get("readyReplicas", 0)
+        check = getattr(pykube, resource["kind"])(self.kube, resource)
 
-            else:
+        try:
+            check.reload()
+        except pykube.PyKubeError:
+            return None
 
-                continue
+        return self.readiness(resource["kind"], check.obj)
+
+    def check(self, obj):
+
+        name = obj['metadata']['name']
+
+        print(f"checking {name}")
+
+        resources = [resource for resource in self.resources(obj) if resource["kind"] in READINESS]
+
+        # Changes to any of these from the watches clear the app's backoff and recheck it right away
+
+        with self.lock:
+            for resource in resources:
+                self.tracked[self.identify(resource)] = name
+
+        for resource in resources:
+
+            status = self.status(resource)
+
+            if status is None:
+                print(f"{self.display(resource)} not found")
+                return False
+
+            (expected, actual) = status
 
             if expected != actual:
                 print(f"{self.display(resource)} not ready {expected} != {actual}")
@@ -650,7 +1110,7 @@ class Daemon(object):
 
             try:
 
-                requests.get(url).raise_for_status()
+                requests.get(url, timeout=PROBE).raise_for_status()
 
             except Exception as exception:
 
@@ -659,7 +1119,10 @@ class Daemon(object):
 
             obj['url'] = url
 
-        print(f"{obj['metadata']['name']} installed")
+        with self.lock:
+            self.tracked = {key: app for key, app in self.tracked.items() if app != name}
+
+        print(f"{name} installed")
 
         obj["status"] = "Installed"
 
@@ -669,7 +1132,7 @@ class Daemon(object):
 
         print(f"destroying {self.display(obj)}")
 
-        for resource in reversed(obj["resources"]):
+        for resource in reversed(self.resources(obj)):
             print(f"deleting {self.display(resource)}")
             try:
                 getattr(pykube, resource["kind"])(self.kube, resource).delete()
@@ -685,40 +1148,107 @@ class Daemon(object):
         obj["action"] = "Preview"
         obj["status"] = "Downloaded"
 
+    def reconcile(self, obj):
+
+        obj.setdefault("status", "Discovered")
+        obj.setdefault("action", "Preview")
+
+        if obj["action"] == "Retry" or obj["status"] == "NeedSettings":
+            return None
+
+        original = copy.deepcopy(obj)
+
+        if isinstance(obj.get("resources"), list):
+            obj["resources"] = self.store.put(obj["resources"])
+
+        try:
+
+            if "spec" not in obj:
+                self.define(obj)
+            elif "resources" not in obj:
+                self.download(obj)
+            elif obj['action'] == "Install" and "created" not in obj:
+                self.create(obj)
+            elif obj['action'] == "Install" and obj.get("status") in ["Installing"]:
+                self.check(obj)
+            elif obj['action'] == "Uninstall":
+                self.destroy(obj)
+            elif obj == original:
+                return None
+
+        except Exception as exception:
+
+            obj["action"] = "Retry"
+            obj["status"] = "Error"
+            obj["error"] = traceback.format_exc().splitlines()[-ERRORS:]
+            traceback.print_exc()
+
+        # Nothing changed means the app is waiting on requirements or readiness
+
+        if obj == original:
+            return False
+
+        store.save(self.kube, original, obj)
+
+        return True
+
+    def settle(self, name, future):
+
+        try:
+            progressed = future.result()
+        except Exception:
+            traceback.print_exc()
+            progressed = False
+
+        if progressed is not False:
+            self.backoffs.pop(name, None)
+            return
+
+        failures = self.backoffs.get(name, (0, 0))[0] + 1
+        delay = min(5 * 2 ** (failures - 1), 120)
+
+        print(f"backing off {name} for {delay}s")
+
+        self.backoffs[name] = (failures, time.time() + delay)
+        self.scheduler.trigger("apps", delay)
+
     def apps(self):
 
+        if not self.kube or self.config["kubernetes"]["role"] != "master":
+            return
+
+        now = time.time()
+
+        pending = {}
+
         for obj in [app.obj for app in pykube.KlotIOApp.objects(self.kube).filter()]:
+            if self.backoffs.get(obj["metadata"]["name"], (0, 0))[1] <= now:
+                pending[obj["metadata"]["name"]] = obj
 
-            obj.setdefault("status", "Discovered")
-            obj.setdefault("action", "Preview")
+        requires = {
+            name: {app["name"] for app in obj.get("spec", {}).get("requires", [])} & set(pending)
+            for name, obj in pending.items()
+        }
 
-            if obj["action"] == "Retry" or obj["status"] == "NeedSettings":
-                continue
+        running = {}
 
-            try:
+        while pending or running:
 
-                if "spec" not in obj:
-                    self.define(obj)
-                elif "resources" not in obj:
-                    self.download(obj)
-                elif obj['action'] == "Install" and "created" not in obj:
-                    self.create(obj)
-                elif obj['action'] == "Install" and obj.get("status") in ["Installing"]:
-                    if not self.check(obj):
-                        continue
-                elif obj['action'] == "Uninstall":
-                    self.destroy(obj)
-                else:
-                    continue
+            blocked = set(pending) | set(running.values())
+            ready = [name for name in sorted(pending) if not requires[name] & blocked]
 
-            except Exception as exception:
+            # A requires cycle would never unblock, so just run whatever is left
 
-                obj["action"] = "Retry"
-                obj["status"] = "Error"
-                obj["error"] = traceback.format_exc().splitlines()
-                traceback.print_exc()
+            if not ready and not running:
+                ready = sorted(pending)
+
+            for name in ready:
+                running[self.workers.submit(self.reconcile, pending.pop(name))] = name
 
-            pykube.KlotIOApp(self.kube, obj).replace()
+            (done, waiting) = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                self.settle(running.pop(future), future)
 
     def nginx(self, expected):
 
@@ -759,62 +1289,31 @@ class Daemon(object):
         nginx = {}
         cnames = set()
 
-        for service in [service.obj for service in pykube.Service.objects(self.kube).filter(namespace=pykube.all)]:
-
-            if (
-                "type" not in service["spec"] or service["spec"]["type"] != "LoadBalancer" or
-                "ports" not in service["spec"] or "selector" not in service["spec"] or
-                "namespace" not in service["metadata"]
-            ):
-                continue
-
-            servers = []
-
-            for port in service["spec"]["ports"]:
-
-                if "name" not in port:
-                    continue
+        with self.lock:
 
-                if port["name"].lower().startswith("https"):
-                    servers.append({
-                        "protocol": "https",
-                        "external": port["port"],
-                        "internal": port["targetPort"]
-                    })
-                elif port["name"].lower().startswith("http"):
-                    servers.append({
-                        "protocol": "http",
-                        "external": port["port"],
-                        "internal": port["targetPort"]
-                    })
-
-            if not servers:
-                continue
+            if not self.kube or not {"Service", "Pod"} <= self.listed:
+                return
 
-            node_ips = {}
+            endpoints = list(self.index.endpoints.items())
+            services = dict(self.index.services)
 
-            for pod in [pod.obj for pod in pykube.Pod.objects(self.kube).filter(
-                namespace=service["metadata"]["namespace"],
-                selector=service["spec"]["selector"]
-            )]:
-                if "nodeName" in pod["spec"] and "podIP" in pod["status"]:
-                    node_ips[pod["spec"]["nodeName"]] = pod["status"]["podIP"]
+        for (namespace, name), node_ips in endpoints:
 
-            if not node_ips or sorted(node_ips.keys())[0] != self.node:
+            if sorted(node_ips.keys())[0] != self.node:
                 continue
 
             ip = node_ips[self.node]
 
             host = ("%s-%s-%s-klot-io.local" % (
-                service["metadata"]["name"],
-                service["metadata"]["namespace"],
+                name,
+                namespace,
                 self.config["kubernetes"]["cluster"]
             ))
 
             cnames.add(host)
             nginx[host] = {
                 "ip": ip,
-                "servers": servers
+                "servers": services[(namespace, name)]["servers"]
             }
 
         if cnames != self.cnames:
@@ -826,13 +1325,120 @@ class Daemon(object):
 
     def clean(self):
 
+        if not self.kube:
+            return
+
         past = time.time() - 60
 
         for tmp_file in list(glob.glob("/tmp/tmp??????")):
             if past > os.path.getmtime(tmp_file):
                 os.remove(tmp_file)
 
-    def process(self):
+    def track(self, kind, obj, action="ADDED"):
+
+        key = (kind, obj["metadata"].get("namespace"), obj["metadata"]["name"])
+        status = self.readiness(kind, obj) if action != "DELETED" else None
+
+        if status == self.ready.get(key):
+            return None
+
+        if status is None:
+            self.ready.pop(key, None)
+        else:
+            self.ready[key] = status
+
+        return self.tracked.get(key)
+
+    @staticmethod
+    def required(obj):
+
+        return {app["name"] for app in obj.get("spec", {}).get("requires", [])}
+
+    def recheck(self, names):
+
+        for name in names:
+            self.backoffs.pop(name, None)
+
+        if names:
+            self.scheduler.trigger("apps")
+
+    def relist(self, kube, kind, objs):
+
+        with self.lock:
+
+            if self.kube is not kube:
+                return
+
+            if kind in READINESS:
+
+                previous = {key for key in self.ready if key[0] == kind}
+                names = {self.track(kind, obj) for obj in objs}
+
+                current = {(kind, obj["metadata"].get("namespace"), obj["metadata"]["name"]) for obj in objs}
+
+                for key in previous - current:
+                    del self.ready[key]
+                    names.add(self.tracked.get(key))
+
+                self.listed.add(kind)
+
+            elif kind == "KlotIOApp":
+                self.requires = {obj["metadata"]["name"]: self.required(obj) for obj in objs}
+
+            else:
+                self.index.relist(kind, objs)
+                self.listed.add(kind)
+
+        if kind in READINESS:
+            self.recheck(names - {None})
+        else:
+            self.scheduler.trigger("apps" if kind == "KlotIOApp" else "services")
+
+    def event(self, kube, kind, action, obj):
+
+        with self.lock:
+
+            if self.kube is not kube:
+                return
+
+            if kind in READINESS:
+
+                names = {self.track(kind, obj, action)} - {None}
+
+            elif kind == "KlotIOApp":
+
+                name = obj["metadata"]["name"]
+
+                if action == "DELETED":
+                    self.requires.pop(name, None)
+                else:
+                    self.requires[name] = self.required(obj)
+
+                # The app and anything waiting on it shouldn't sit out a backoff now that it changed
+
+                names = {name} | {app for app, required in self.requires.items() if name in required}
+
+            elif not self.index.event(kind, action, obj):
+                return
+
+        if kind in READINESS or kind == "KlotIOApp":
+            self.recheck(names)
+        else:
+            self.scheduler.trigger("services")
+
+    def watch(self):
+
+        kinds = ["Service", "Pod"]
+
+        if self.config["kubernetes"]["role"] == "master":
+            kinds.append("KlotIOApp")
+            kinds.extend(READINESS)
+
+        for kind in kinds:
+            if kind not in self.watches or not self.watches[kind].thread.is_alive():
+                self.watches[kind] = endpoint.Watch(self, kind)
+
+    def boot(self):
 
         if os.path.exists("/boot/klot-io/reset"):
             self.reset()
@@ -841,8 +1447,10 @@ class Daemon(object):
             self.restart()
 
         self.reload()
+
+    def configure(self):
+
         self.load()
-        self.uninitialized()
 
         if "account" in self.modified:
             self.account()
@@ -853,27 +1461,41 @@ class Daemon(object):
         if "kubernetes" in self.modified:
             self.kubernetes()
 
-        if not self.kube and os.path.exists("/home/pi/.kube/config"):
-            self.kube = pykube.HTTPClient(pykube.KubeConfig.from_file("/home/pi/.kube/config"))
+        with self.lock:
 
-        if self.kube:
+            if self.kube and not os.path.exists("/home/pi/.kube/config"):
+                self.kube = None
 
-            if self.config["kubernetes"]["role"] == "master":
-                self.apps()
+            if not self.kube and os.path.exists("/home/pi/.kube/config"):
+                self.kube = pykube.HTTPClient(pykube.KubeConfig.from_file("/home/pi/.kube/config"))
+                self.index = endpoint.Index()
+                self.listed = set()
+                self.watches = {}
+                self.ready = {}
+                self.tracked = {}
+                self.requires = {}
 
-            self.services()
-            self.clean()
+        if self.kube:
+            self.watch()
 
-    def run(self):
+    def notify(self):
+
+        try:
+            inotify = Inotify()
+        except (OSError, AttributeError) as exception:
+            print(f"inotify unavailable, polling only: {exception}")
+            return
 
         while True:
 
-            try:
+            for path in NOTIFY:
+                inotify.add(path)
 
-                self.process()
+            for path in inotify.read(30):
+                self.scheduler.trigger(NOTIFY[path])
 
-            except Exception as exception:
+    def run(self):
 
-                traceback.print_exc()
+        threading.Thread(target=self.notify, daemon=True).start()
 
-            time.sleep(5)
+        self.scheduler.run()
@@ -39,10 +39,10 @@ class Deploy:
             for path in os.listdir(source):
                 self.put(f"{source}/{path}")
 
-    def update(self, service, source):
+    def update(self, service, source, action="restart"):
 
         self.put(source)
-        self.execute(f"sudo systemctl restart {service}")
+        self.execute(f"sudo systemctl {action} {service}")
 
     def close(self):
 
@@ -0,0 +1,241 @@
+import json
+import time
+import pykube
+import threading
+import traceback
+
+# Seconds a watch runs before the server ends it and we reconnect
+
+TIMEOUT = 300
+
+class Index(object):
+
+    def __init__(self):
+
+        self.services = {}
+        self.pods = {}
+        self.endpoints = {}
+
+    @staticmethod
+    def service(obj):
+
+        if (
+            "type" not in obj["spec"] or obj["spec"]["type"] != "LoadBalancer" or
+            "ports" not in obj["spec"] or "selector" not in obj["spec"] or
+            "namespace" not in obj["metadata"]
+        ):
+            return None
+
+        servers = []
+
+        for port in obj["spec"]["ports"]:
+
+            if "name" not in port:
+                continue
+
+            if port["name"].lower().startswith("https"):
+                servers.append({
+                    "protocol": "https",
+                    "external": port["port"],
+                    "internal": port["targetPort"]
+                })
+            elif port["name"].lower().startswith("http"):
+                servers.append({
+                    "protocol": "http",
+                    "external": port["port"],
+                    "internal": port["targetPort"]
+                })
+
+        if not servers:
+            return None
+
+        return {
+            "selector": obj["spec"]["selector"],
+            "servers": servers
+        }
+
+    @staticmethod
+    def pod(obj):
+
+        if "nodeName" not in obj["spec"] or "podIP" not in obj["status"]:
+            return None
+
+        return (obj["metadata"].get("labels", {}), obj["spec"]["nodeName"], obj["status"]["podIP"])
+
+    def match(self, key):
+
+        service = self.services.get(key)
+
+        node_ips = {}
+
+        if service:
+            for labels, node, ip in self.pods.get(key[0], {}).values():
+                if all(labels.get(label) == value for label, value in service["selector"].items()):
+                    node_ips[node] = ip
+
+        if node_ips:
+            self.endpoints[key] = node_ips
+        else:
+            self.endpoints.pop(key, None)
+
+    def relist(self, kind, objs):
+
+        if kind == "Service":
+
+            self.services = {}
+
+            for obj in objs:
+                service = self.service(obj)
+                if service:
+                    self.services[(obj["metadata"]["namespace"], obj["metadata"]["name"])] = service
+
+        elif kind == "Pod":
+
+            self.pods = {}
+
+            for obj in objs:
+                pod = self.pod(obj)
+                if pod:
+                    self.pods.setdefault(obj["metadata"]["namespace"], {})[obj["metadata"]["name"]] = pod
+
+        self.endpoints = {}
+
+        for key in self.services:
+            self.match(key)
+
+    def event(self, kind, action, obj):
+
+        name = obj["metadata"]["name"]
+        namespace = obj["metadata"].get("namespace")
+
+        if kind == "Service":
+
+            service = self.service(obj) if action != "DELETED" else None
+
+            if service == self.services.get((namespace, name)):
+                return False
+
+            if service:
+                self.services[(namespace, name)] = service
+            else:
+                self.services.pop((namespace, name), None)
+
+            self.match((namespace, name))
+
+        elif kind == "Pod":
+
+            pods = self.pods.setdefault(namespace, {})
+            pod = self.pod(obj) if action != "DELETED" else None
+
+            if pod == pods.get(name):
+                return False
+
+            if pod:
+                pods[name] = pod
+            else:
+                pods.pop(name, None)
+
+            for key in self.services:
+                if key[0] == namespace:
+                    self.match(key)
+
+        return True
+
+class Watch(object):
+
+    def __init__(self, daemon, kind):
+
+        self.daemon = daemon
+        self.kube = daemon.kube
+        self.kind = kind
+        self.version = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def current(self):
+
+        return self.daemon.kube is self.kube
+
+    def query(self):
+
+        Resource = getattr(pykube, self.kind)
+
+        if not issubclass(Resource, pykube.objects.NamespacedAPIObject):
+            return Resource.objects(self.kube).filter()
+
+        return Resource.objects(self.kube).filter(namespace=pykube.all)
+
+    def list(self):
+
+        print(f"listing {self.kind}")
+
+        response = self.query().response
+
+        self.daemon.relist(self.kube, self.kind, response.get("items") or [])
+        self.version = response["metadata"]["resourceVersion"]
+
+    def stream(self):
+
+        query = self.query()
+
+        # The server ends the watch after TIMEOUT and the read timeout catches a connection
+        # that died without closing, either way we reconnect from the last version
+
+        params = {"watch": "true", "timeoutSeconds": TIMEOUT}
+
+        if self.version is not None:
+            params["resourceVersion"] = self.version
+
+        kwargs = {
+            "url": query._build_api_url(params),
+            "version": query.api_obj_class.version,
+            "stream": True,
+            "timeout": (5, TIMEOUT + 30)
+        }
+
+        if query.api_obj_class.base:
+            kwargs["base"] = query.api_obj_class.base
+
+        if query.namespace is not None and query.namespace is not pykube.all:
+            kwargs["namespace"] = query.namespace
+
+        response = self.kube.get(**kwargs)
+        self.kube.raise_for_status(response)
+
+        try:
+
+            for line in response.iter_lines():
+
+                if not self.current():
+                    return
+
+                event = json.loads(line.decode("utf-8"))
+
+                if event["type"] == "ERROR":
+                    print(f"{self.kind} watch expired: {event['object'].get('message')}")
+                    self.version = None
+                    return
+
+                self.daemon.event(self.kube, self.kind, event["type"], event["object"])
+                self.version = event["object"]["metadata"]["resourceVersion"]
+
+        finally:
+
+            response.close()
+
+    def run(self):
+
+        while self.current():
+
+            try:
+
+                if self.version is None:
+                    self.list()
+
+                self.stream()
+
+            except Exception:
+
+                traceback.print_exc()
+                time.sleep(5)
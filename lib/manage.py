@@ -1,12 +1,23 @@
 import os
+import copy
+import glob
 import json
+import math
+import time
 import yaml
+import hmac
+import queue
+import array
+import hashlib
 import requests
 import platform
 import calendar
 import operator
 import functools
-import subprocess
+import threading
+import traceback
+import collections
+import concurrent.futures
 
 import flask
 import flask_restful
@@ -16,11 +27,20 @@ import google_auth_oauthlib.flow
 import google.oauth2.credentials
 import googleapiclient.discovery
 
-def app():
+import store
+import endpoint
+
+def app(staleness=5, streams=16):
 
     app = flask.Flask("klot-io-api")
 
     app.kube = None
+    app.kubing = threading.Lock()
+    app.snapshot = Snapshot(staleness)
+    app.metrics = Metrics()
+    app.metrics.start()
+    app.feed = Feed()
+    app.streams = threading.BoundedSemaphore(streams)
 
     api = flask_restful.Api(app)
 
@@ -28,6 +48,7 @@ def app():
     api.add_resource(Log, '/log/<string:service>')
     api.add_resource(Config, '/config')
     api.add_resource(Status, '/status')
+    api.add_resource(Metric, '/metrics')
     api.add_resource(Kubectl, '/kubectl')
     api.add_resource(Node, '/node')
     api.add_resource(Namespace, '/namespace')
@@ -36,34 +57,665 @@ def app():
     api.add_resource(PodRD, '/pod/<string:pod>')
     api.add_resource(AppLP, '/app')
     api.add_resource(AppRIU, '/app/<string:name>')
+    api.add_resource(Stream, '/stream')
 
     return app
 
 
 def kube():
 
-    if not os.path.exists("/home/pi/.kube/config"):
+    # One client per worker process, shared by every request thread and the stream feed. It's
+    # a requests.Session underneath, whose connection pool is thread safe, and nothing changes
+    # it once made, so the lock only keeps threads from creating it at the same time.
+
+    with flask.current_app.kubing:
+
+        if not os.path.exists("/home/pi/.kube/config"):
+
+            flask.current_app.kube = None
+
+        elif not flask.current_app.kube:
+
+            flask.current_app.kube = pykube.HTTPClient(pykube.KubeConfig.from_file("/home/pi/.kube/config"))
+
+        return flask.current_app.kube
+
+
+def streaming(events):
+
+    # Each stream holds a thread for minutes, so there are fewer allowed than serve.threads
+    # and ordinary requests always have a thread left
+
+    streams = flask.current_app.streams
+
+    if not streams.acquire(blocking=False):
+        return {"error": "too many streams"}, 503
+
+    response = flask.Response(
+        flask.stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+    response.call_on_close(streams.release)
+
+    return response
+
+
+class Snapshot(object):
+
+    def __init__(self, staleness=5):
+
+        self.staleness = staleness
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.loading = {}
+
+    def get(self, key, load):
+
+        with self.lock:
+
+            entry = self.entries.get(key)
+
+            if entry and entry[0] > time.time():
+                return entry[1]
+
+            loading = self.loading.setdefault(key, threading.Lock())
+
+        # Only one request loads a stale key, the rest wait and share its result
+
+        with loading:
+
+            with self.lock:
+
+                entry = self.entries.get(key)
+
+                if entry and entry[0] > time.time():
+                    return entry[1]
+
+            value = load()
+
+            with self.lock:
+                self.evict()
+                self.entries[key] = (time.time() + self.staleness, value)
+
+        return value
+
+    def evict(self):
+
+        # Drop what's expired so keys nobody asks for again, like an old client's, don't pile up
+
+        now = time.time()
+
+        for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            del self.entries[key]
+
+        for key in [key for key, loading in self.loading.items() if key not in self.entries and not loading.locked()]:
+            del self.loading[key]
+
+    def invalidate(self, kind):
+
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == kind]:
+                del self.entries[key]
+
+
+class Feed(object):
+
+    # Kubernetes kind and the name the rest of the API returns it under
+
+    KINDS = {
+        "Node": "nodes",
+        "Pod": "pods",
+        "Event": "events",
+        "KlotIOApp": "apps"
+    }
+
+    def __init__(self, history=256, duration=300):
+
+        self.duration = duration
+        self.condition = threading.Condition()
+        self.kube = None
+        self.watches = {}
+        self.state = {}
+        self.listed = set()
+        self.changes = collections.deque(maxlen=history)
+        self.version = 0
+        self.base = 0
+
+        # Versions only mean something within this process, so clients get them tagged with it
+
+        self.epoch = f"{os.getpid():x}{int(time.time() * 1000):x}"
+
+    @staticmethod
+    def key(obj):
+
+        if "namespace" in obj["metadata"]:
+            return f"{obj['metadata']['namespace']}/{obj['metadata']['name']}"
+
+        return obj["metadata"]["name"]
+
+    @staticmethod
+    def project(kind, obj):
+
+        if kind == "Node":
+            return Node.compact(obj)
+
+        if kind == "Pod":
+            return Pod.compact(obj)
+
+        if kind == "Event":
+            return Event.compact(obj)
+
+        return App.to_dict(obj, short=True)
+
+    def start(self, client):
+
+        with self.condition:
+
+            if client is not self.kube:
+                self.kube = client
+                self.state = {kind: {} for kind in self.KINDS}
+                self.listed = set()
+                self.changes.clear()
+                self.version += 1
+                self.base = self.version
+                self.condition.notify_all()
+
+            for kind in self.KINDS:
+                if kind not in self.watches or self.watches[kind].kube is not client or not self.watches[kind].thread.is_alive():
+                    self.watches[kind] = endpoint.Watch(self, kind)
+
+    def change(self, kind, upsert, delete):
+
+        if not upsert and not delete:
+            return
+
+        self.version += 1
+
+        self.changes.append({
+            "version": self.version,
+            "kind": self.KINDS[kind],
+            "upsert": upsert,
+            "delete": delete
+        })
+
+        self.condition.notify_all()
+
+    def relist(self, client, kind, objs):
+
+        with self.condition:
+
+            if client is not self.kube:
+                return
+
+            current = {self.key(obj): self.project(kind, obj) for obj in objs}
+            previous = self.state[kind]
+
+            upsert = {key: item for key, item in current.items() if previous.get(key) != item}
+            delete = [key for key in previous if key not in current]
+
+            self.state[kind] = current
+            self.listed.add(kind)
+            self.change(kind, upsert, delete)
+
+    def event(self, client, kind, action, obj):
+
+        with self.condition:
+
+            if client is not self.kube:
+                return
+
+            key = self.key(obj)
+            state = self.state[kind]
+
+            if action == "DELETED":
+                if state.pop(key, None) is not None:
+                    self.change(kind, {}, [key])
+                return
+
+            item = self.project(kind, obj)
+
+            # Most updates don't touch anything we project, so they never reach clients
+
+            if state.get(key) != item:
+                state[key] = item
+                self.change(kind, {key: item}, [])
+
+    def items(self, kind):
+
+        with self.condition:
+
+            if kind not in self.listed:
+                return None
+
+            return list(self.state[kind].values())
+
+    def resume(self, cursor):
+
+        (epoch, separator, version) = (cursor or "").rpartition(".")
+
+        if epoch != self.epoch or not version.isdigit():
+            return None
+
+        return int(version)
+
+    def since(self, version):
+
+        floor = self.changes[0]["version"] - 1 if len(self.changes) == self.changes.maxlen else self.base
+
+        if version is None or version < floor or version > self.version:
+            return None
+
+        return [change for change in self.changes if change["version"] > version]
+
+    def reset(self, kinds):
+
+        return {
+            "version": self.version,
+            "reset": {self.KINDS[kind]: dict(self.state[kind]) for kind in self.KINDS if self.KINDS[kind] in kinds}
+        }
+
+    def events(self, version, kinds):
+
+        # Close now and then so clients reconnect and nothing buffers forever
+
+        deadline = time.time() + self.duration
+
+        while time.time() < deadline:
+
+            with self.condition:
+
+                self.condition.wait_for(lambda: version is None or self.version != version, timeout=min(15, max(deadline - time.time(), 0)))
+
+                changes = self.since(version)
+
+                if changes is None:
+                    changes = [self.reset(kinds)]
+
+                changes = [change for change in changes if "reset" in change or change["kind"] in kinds]
+                version = self.version
+
+            if not changes:
+                yield ": keepalive\n\n"
+
+            for change in changes:
+                cursor = f"{self.epoch}.{change['version']}"
+                yield f"id: {cursor}\ndata: {json.dumps(dict(change, version=cursor))}\n\n"
+
+
+class Ring(object):
+
+    FIELDS = ["load", "cpu", "memory", "temperature"]
+
+    def __init__(self, step, size):
+
+        self.step = step
+        self.size = size
+        self.count = 0
+
+        self.times = array.array('l', [0] * size)
+        self.values = {field: array.array('f', [math.nan] * size) for field in self.FIELDS}
+
+        self.bucket = None
+        self.sums = {field: 0.0 for field in self.FIELDS}
+        self.counts = {field: 0 for field in self.FIELDS}
+
+    def flush(self):
+
+        index = self.count % self.size
+
+        self.times[index] = self.bucket
+
+        for field in self.FIELDS:
+            self.values[field][index] = self.sums[field] / self.counts[field] if self.counts[field] else math.nan
+            self.sums[field] = 0.0
+            self.counts[field] = 0
+
+        self.count += 1
+
+    def add(self, timestamp, values):
+
+        bucket = timestamp - timestamp % self.step
+
+        if self.bucket is not None and bucket != self.bucket:
+            self.flush()
+
+        self.bucket = bucket
+
+        for field in self.FIELDS:
+            if values.get(field) is not None:
+                self.sums[field] += values[field]
+                self.counts[field] += 1
+
+    def range(self, start, end):
+
+        points = []
+        stored = min(self.count, self.size)
+
+        for offset in range(stored):
+
+            index = (self.count - stored + offset) % self.size
+
+            if start <= self.times[index] <= end:
+                points.append([self.times[index]] + [
+                    None if math.isnan(self.values[field][index]) else round(self.values[field][index], 2)
+                    for field in self.FIELDS
+                ])
+
+        return points
+
+
+class Metrics(object):
+
+    # 1 second for 10 minutes, 1 minute for a day, 1 hour for 30 days - about 70KB in all
+
+    RESOLUTIONS = [(1, 600), (60, 1440), (3600, 720)]
+
+    def __init__(self, interval=1, every=5, history=12):
+
+        self.interval = interval
+        self.every = every
+        self.lock = threading.Lock()
+        self.samples = collections.deque(maxlen=history)
+        self.rings = [Ring(step, size) for step, size in self.RESOLUTIONS]
+        self.last = None
+        self.cpu = None
+
+    @staticmethod
+    def loadavg():
+
+        with open("/proc/loadavg", "r") as loadavg_file:
+            return [float(value) for value in loadavg_file.read().split()[:3]]
+
+    @staticmethod
+    def meminfo():
+
+        meminfo = {}
+
+        with open("/proc/meminfo", "r") as meminfo_file:
+            for meminfo_line in meminfo_file:
+                (title, value) = meminfo_line.split(":", 1)
+                meminfo[title] = int(value.split()[0])
+
+        # Same columns and arithmetic as procps free, in KiB
+
+        cache = meminfo.get("Buffers", 0) + meminfo.get("Cached", 0) + meminfo.get("SReclaimable", 0)
+
+        return {
+            "total": meminfo["MemTotal"],
+            "used": meminfo["MemTotal"] - meminfo["MemFree"] - cache,
+            "free": meminfo["MemFree"],
+            "shared": meminfo.get("Shmem", 0),
+            "buff/cache": cache,
+            "available": meminfo.get("MemAvailable", meminfo["MemFree"])
+        }
+
+    def usage(self):
+
+        with open("/proc/stat", "r") as stat_file:
+            values = [int(value) for value in stat_file.readline().split()[1:]]
+
+        idle = values[3] + values[4]
+        total = sum(values[:8])
+
+        previous = self.cpu
+        self.cpu = (idle, total)
+
+        if previous is None or total == previous[1]:
+            return None
+
+        return round(100.0 * (1 - (idle - previous[0]) / (total - previous[1])), 1)
+
+    @staticmethod
+    def temperature():
+
+        temperatures = []
+
+        for zone_path in glob.glob("/sys/class/thermal/thermal_zone*/temp"):
+            try:
+                with open(zone_path, "r") as zone_file:
+                    temperatures.append(int(zone_file.read().strip()) / 1000.0)
+            except (OSError, ValueError):
+                pass
+
+        return max(temperatures) if temperatures else None
+
+    def sample(self):
+
+        sample = {
+            "timestamp": int(time.time()),
+            "load": self.loadavg(),
+            "free": self.meminfo(),
+            "cpu": self.usage(),
+            "temperature": self.temperature()
+        }
+
+        values = {
+            "load": sample["load"][0],
+            "cpu": sample["cpu"],
+            "memory": 100.0 * sample["free"]["used"] / sample["free"]["total"],
+            "temperature": sample["temperature"]
+        }
+
+        with self.lock:
+
+            self.last = sample
+
+            for ring in self.rings:
+                ring.add(sample["timestamp"], values)
+
+            if not self.samples or sample["timestamp"] - self.samples[-1]["timestamp"] >= self.every:
+                self.samples.append(sample)
+
+        return sample
+
+    def run(self):
+
+        while True:
+
+            try:
+                self.sample()
+            except Exception:
+                traceback.print_exc()
+
+            time.sleep(self.interval)
+
+    def start(self):
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def latest(self):
+
+        with self.lock:
+            if self.last:
+                return self.last
+
+        return self.sample()
+
+    def history(self):
+
+        with self.lock:
+            return list(self.samples)
+
+    def range(self, start, end, step=None):
+
+        for ring in self.rings:
+            if (step is None and start >= end - ring.step * ring.size) or ring.step == step:
+                break
+
+        with self.lock:
+            points = ring.range(start, end)
+
+        return {"step": ring.step, "fields": Ring.FIELDS, "points": points}
+
+
+def objects(kind):
+
+    client = kube()
+
+    return flask.current_app.snapshot.get(
+        (kind, id(client)),
+        lambda: [obj.obj for obj in getattr(pykube, kind).objects(client).filter()]
+    )
+
+
+def invalidate(kind):
+
+    flask.current_app.snapshot.invalidate(kind)
+
+
+def summaries():
+
+    # App summaries from the stream feed's watch, or straight from Kubernetes until it has listed
+
+    feed = flask.current_app.feed
+    feed.start(kube())
+
+    apps = feed.items("KlotIOApp")
+
+    if apps is None:
+        apps = [App.to_dict(obj, short=True) for obj in objects("KlotIOApp")]
+
+    return apps
+
+
+def integer(name, default=None):
+
+    value = flask.request.args.get(name)
+
+    if value is None:
+        return default
+
+    try:
+        return int(value)
+    except ValueError:
+        flask_restful.abort(400, error=f"invalid {name}: {value}")
+
+
+def listing(kind, token=None):
+
+    # One page of kind from Kubernetes, filtered and paginated by the request's arguments
+
+    args = flask.request.args
+    Resource = getattr(pykube, kind)
+
+    query = Resource.objects(kube()).filter(
+        namespace=args.get("namespace", pykube.all),
+        selector=args.get("selector"),
+        field_selector=args.get("field")
+    )
+
+    params = {}
+
+    if "limit" in args:
+        params["limit"] = integer("limit")
+
+    if token or "continue" in args:
+        params["continue"] = token or args["continue"]
+
+    kwargs = {
+        "url": query._build_api_url(params),
+        "version": Resource.version
+    }
+
+    if query.namespace is not pykube.all:
+        kwargs["namespace"] = query.namespace
+
+    response = kube().get(**kwargs)
+
+    # A bad selector or expired continue token is the client's to fix, so pass it on
+
+    if 400 <= response.status_code < 500:
+
+        try:
+            error = response.json().get("message", response.reason)
+        except ValueError:
+            error = response.reason
+
+        flask_restful.abort(response.status_code, error=error)
+
+    response.raise_for_status()
+
+    return response.json()
+
+
+def paged(name, items, listed):
+
+    if "fields" in flask.request.args:
+        fields = flask.request.args["fields"].split(",")
+        items = [{field: item[field] for field in fields if field in item} for item in items]
+
+    page = {name: items}
+
+    if listed["metadata"].get("continue"):
+        page["continue"] = listed["metadata"]["continue"]
+
+    return page
+
+
+def conditional(endpoint):
+    @functools.wraps(endpoint)
+    def wrap(*args, **kwargs):
+
+        response = endpoint(*args, **kwargs)
+
+        if not isinstance(response, dict):
+            return response
+
+        etag = hashlib.sha1(json.dumps(response, sort_keys=True).encode('utf-8')).hexdigest()
+
+        if flask.request.if_none_match.contains(etag):
+            return flask.Response(status=304, headers={"ETag": f'"{etag}"'})
+
+        return response, 200, {"ETag": f'"{etag}"'}
+
+    return wrap
+
 
-        flask.current_app.kube = None
+class Settings(object):
 
-    elif not flask.current_app.kube:
+    def __init__(self):
 
-        flask.current_app.kube = pykube.HTTPClient(pykube.KubeConfig.from_file("/home/pi/.kube/config"))
+        self.lock = threading.Lock()
+        self.entries = {}
 
-    return flask.current_app.kube
+    def load(self, path):
+
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+
+            entry = self.entries.get(path)
+
+            if entry and entry[0] == version:
+                return entry[1]
+
+        with open(path, "r") as config_file:
+            value = yaml.safe_load(config_file)
+
+        with self.lock:
+            self.entries[path] = (version, value)
+
+        return value
+
+    def forget(self, path):
+
+        with self.lock:
+            self.entries.pop(path, None)
 
 
 def require_auth(endpoint):
     @functools.wraps(endpoint)
     def wrap(*args, **kwargs):
 
-        with open("/opt/klot-io/config/account.yaml", "r") as config_file:
-            password = yaml.safe_load(config_file)["password"]
+        password = str(Config.settings.load("/opt/klot-io/config/account.yaml")["password"])
 
         if "x-klot-io-password" not in flask.request.headers:
             return {"error": "missing password"}, 400
 
-        if flask.request.headers["x-klot-io-password"] != password:
+        if not hmac.compare_digest(flask.request.headers["x-klot-io-password"].encode('utf-8'), password.encode('utf-8')):
             return {"error": "invalid password"}, 401
 
         return endpoint(*args, **kwargs)
@@ -90,41 +742,137 @@ class Health(flask_restful.Resource):
 
 class Log(flask_restful.Resource):
 
-    @require_auth
-    def get(self, service):
+    LIMIT = 1000
+    DURATION = 300
 
-        import systemd.journal
+    @staticmethod
+    def line(entry):
 
-        if service not in ["dns", "daemon", "api", "gui"]:
-            return {"error": f"invalid service: {sevice}"}, 400
+        return {
+            "cursor": entry["__CURSOR"],
+            "timestamp": calendar.timegm(entry["__REALTIME_TIMESTAMP"].timetuple()),
+            "message": entry["MESSAGE"]
+        }
+
+    @staticmethod
+    def reader(service):
+
+        import systemd.journal
 
         reader = systemd.journal.Reader()
         reader.add_match(_SYSTEMD_UNIT="nginx.service" if service == "gui" else f"klot-io-{service}.service")
-        reader.seek_tail()
 
-        back = int(flask.request.args["back"]) if "back" in flask.request.args else 60
+        return reader
+
+    @classmethod
+    def previous(cls, reader, back):
+
+        reader.seek_tail()
 
         lines = []
 
         for index in range(back):
 
-            line = reader.get_previous()
+            entry = reader.get_previous()
 
-            if not line:
+            if not entry:
                 break
 
-            lines.insert(0, {
-                "timestamp": calendar.timegm(line["__REALTIME_TIMESTAMP"].timetuple()),
-                "message": line['MESSAGE']
-            })
+            lines.append(cls.line(entry))
+
+        lines.reverse()
 
-        return {"lines": lines}
+        # Leave the reader on the newest entry so get_next only returns what's new
+
+        reader.seek_tail()
+        reader.get_previous()
+
+        return lines
+
+    @classmethod
+    def since(cls, reader, cursor, limit):
+
+        reader.seek_cursor(cursor)
+
+        entry = reader.get_next()
+
+        lines = []
+
+        # If the cursor's entry was vacuumed, we've landed on the next one, which is new
+
+        if entry and not reader.test_cursor(cursor):
+            lines.append(cls.line(entry))
+
+        while len(lines) < limit:
+
+            entry = reader.get_next()
+
+            if not entry:
+                break
+
+            lines.append(cls.line(entry))
+
+        return lines
+
+    @classmethod
+    def follow(cls, reader, lines):
+
+        def events():
+
+            for line in lines:
+                yield f"id: {line['cursor']}\ndata: {json.dumps(line)}\n\n"
+
+            # Close now and then, like the feed, so a dead client doesn't hold a thread and
+            # live ones reconnect with ?cursor= from the last id
+
+            deadline = time.time() + cls.DURATION
+
+            while time.time() < deadline:
+
+                if reader.wait(min(15, max(deadline - time.time(), 0))) == 0:
+                    yield ": keepalive\n\n"
+                    continue
+
+                while True:
+
+                    entry = reader.get_next()
+
+                    if not entry:
+                        break
+
+                    line = cls.line(entry)
+
+                    yield f"id: {line['cursor']}\ndata: {json.dumps(line)}\n\n"
+
+        return streaming(events())
+
+    @require_auth
+    def get(self, service):
+
+        if service not in ["dns", "daemon", "api", "gui"]:
+            return {"error": f"invalid service: {service}"}, 400
+
+        reader = self.reader(service)
+
+        if "cursor" in flask.request.args:
+            limit = min(integer("limit", self.LIMIT), self.LIMIT)
+            lines = self.since(reader, flask.request.args["cursor"], limit)
+        else:
+            lines = self.previous(reader, integer("back", 60))
+
+        if flask.request.args.get("follow") == "true":
+            return self.follow(reader, lines)
+
+        cursor = lines[-1]["cursor"] if lines else flask.request.args.get("cursor")
+
+        return {"lines": lines, "cursor": cursor}
 
 
 class Config(flask_restful.Resource):
 
     name = "config"
     sections = ["account", "network", "kubernetes"]
+    settings = Settings()
 
     @classmethod
     def fields(cls, values):
@@ -217,8 +965,7 @@ class Config(flask_restful.Resource):
 
         for section in cls.sections:
             if os.path.exists(f"/opt/klot-io/config/{section}.yaml"):
-                with open(f"/opt/klot-io/config/{section}.yaml", "r") as config_file:
-                    originals[section] = yaml.safe_load(config_file)
+                originals[section] = copy.deepcopy(cls.settings.load(f"/opt/klot-io/config/{section}.yaml"))
             else:
                 originals[section] = {}
 
@@ -251,6 +998,7 @@ class Config(flask_restful.Resource):
         for section in self.sections:
             with open(f"/opt/klot-io/config/{section}.yaml", "w") as config_file:
                 yaml.safe_dump(fields[section].values, config_file, default_flow_style=False)
+            self.settings.forget(f"/opt/klot-io/config/{section}.yaml")
 
         return {self.name: flask.request.json[self.name]}, 202
 
@@ -334,119 +1082,259 @@ class Status(flask_restful.Resource):
 
             status = "NotReady"
 
-            for node in pykube.Node.objects(kube()).filter():
-                for condition in node.obj["status"]["conditions"]:
+            for node in objects("Node"):
+                for condition in node["status"]["conditions"]:
                     if condition["type"] == "Ready" and condition["status"]:
-                        if node.obj["metadata"]["name"] != platform.node():
+                        if node["metadata"]["name"] != platform.node():
                             status = "Workers"
                         elif status == "NotReady":
                             status = "Master"
 
             if status == "Workers":
-                for obj in [app.obj for app in pykube.KlotIOApp.objects(kube()).filter()]:
-                    if obj.get("status") == "Installed" and "url" in obj:
+                for app in summaries():
+                    if app["status"] == "Installed" and "url" in app:
                         status = "Apps"
                         break
 
-        load = [float(value) for value in subprocess.check_output("uptime").decode('utf-8').split("age: ")[-1].split(', ')]
-        memory = subprocess.check_output("free").decode('utf-8').split("\n")[:-1]
-        titles = memory[0].split()
-        values = memory[1].split()[1:]
-        free = {title: int(values[index]) for index, title in enumerate(titles)}
+        metrics = flask.current_app.metrics
+        latest = metrics.latest()
+
+        return {
+            "status": status,
+            "load": latest["load"],
+            "free": latest["free"],
+            "cpu": latest["cpu"],
+            "temperature": latest["temperature"],
+            "history": metrics.history()
+        }
+
+
+class Metric(flask_restful.Resource):
+
+    @require_auth
+    def get(self):
+
+        end = integer("end", int(time.time()))
+        start = integer("start", end - 600)
+        step = integer("step")
+
+        metrics = flask.current_app.metrics.range(start, end, step)
+        metrics["node"] = platform.node()
 
-        return {"status": status, "load": load, "free": free}
+        return {"metrics": metrics}
 
 
 class Node(flask_restful.Resource):
 
     name = "node"
 
+    # Connect and read timeouts for each node, how long a request waits on all of them, and how long
+    # a node that didn't answer is skipped so a powered off one only costs the first request
+
+    timeout = (1, 5)
+    deadline = 2
+    backoff = 30
+
+    workers = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    sessions = {}
+    unreachable = {}
+    lock = threading.Lock()
+
     @staticmethod
     def uninitialized():
         return os.path.exists("/opt/klot-io/config/uninitialized")
 
+    @classmethod
+    def session(cls, host):
+
+        with cls.lock:
+
+            if host not in cls.sessions:
+                cls.sessions[host] = requests.Session()
+
+            return cls.sessions[host]
+
+    @classmethod
+    def request(cls, host, path, password, params=None):
+
+        with cls.lock:
+            if cls.unreachable.get(host, 0) > time.time():
+                return None
+
+        try:
+
+            return cls.session(host).get(
+                f"http://{host}/api/{path}", timeout=cls.timeout,
+                headers={"x-klot-io-password": password}, params=params
+            )
+
+        except requests.RequestException:
+
+            with cls.lock:
+                cls.unreachable[host] = time.time() + cls.backoff
+
+            return None
+
+    @classmethod
+    def status(cls, host, *passwords):
+
+        for password in passwords:
+
+            response = cls.request(host, "status", password)
+
+            if response is None:
+                return None
+
+            if response.status_code == 200:
+                return response.json()
+
+        return None
+
+    @classmethod
+    def metrics(cls, host, password, seconds):
+
+        response = cls.request(host, "metrics", password, {"start": int(time.time()) - seconds})
+
+        if response is not None and response.status_code == 200:
+            return response.json()["metrics"]
+
+        return None
+
+    @staticmethod
+    def aggregate(histories):
+
+        points = {}
+
+        for history in histories:
+            for point in history["points"]:
+                points.setdefault(point[0], []).append(point[1:])
+
+        aggregated = []
+
+        for timestamp in sorted(points):
+
+            point = [timestamp]
+
+            for column in zip(*points[timestamp]):
+                values = [value for value in column if value is not None]
+                point.append(round(sum(values) / len(values), 2) if values else None)
+
+            aggregated.append(point)
+
+        return {"step": histories[0]["step"] if histories else None, "fields": Ring.FIELDS, "points": aggregated}
+
+    @staticmethod
+    def compact(obj):
+
+        node = {
+            "name": obj["metadata"]["name"],
+            "status": "NotReady",
+            "role": "master" if obj["metadata"]["name"] == platform.node() else "worker"
+        }
+
+        if "labels" in obj["metadata"]:
+            node["labels"] = obj["metadata"]["labels"]
+
+        for condition in obj["status"]["conditions"]:
+            if condition["type"] == "Ready" and condition["status"] == "True":
+                node["status"] = "Ready"
+
+        return node
+
+    @staticmethod
+    def result(future, done):
+
+        if future not in done or future.exception() is not None:
+            return None
+
+        return future.result()
+
     @require_auth
+    @conditional
     def get(self):
 
         nodes = []
         master = None
         workers = []
 
-        if kube():
+        password = flask.request.headers["x-klot-io-password"]
+        snapshot = flask.current_app.snapshot
 
-            for obj in [node.obj for node in pykube.Node.objects(kube()).filter()]:
+        objs = objects("Node") if kube() else []
 
-                node = {
-                    "name": obj["metadata"]["name"],
-                    "status": "NotReady"
-                }
+        statuses = {
+            obj["metadata"]["name"]: self.workers.submit(
+                snapshot.get, ("status", obj["metadata"]["name"]),
+                functools.partial(self.status, f"{obj['metadata']['name']}.local", password)
+            )
+            for obj in objs
+        }
 
-                try:
+        if self.uninitialized():
+            statuses[None] = self.workers.submit(self.status, "klot-io.local", "kloudofthings", password)
 
-                    response = requests.get(
-                        f"http://{node['name']}.local/api/status", timeout=5,
-                        headers={"x-klot-io-password": flask.request.headers["x-klot-io-password"]}
-                    )
+        histories = {}
 
-                    if response.status_code == 200:
-                        data = response.json()
-                        node["load"] = data["load"]
-                        node["free"] = data["free"]
+        if "history" in flask.request.args:
 
-                except:
+            # Rounded up to a whole ring, so there are only ever a few of these to cache
 
-                    pass
+            spans = [step * size for step, size in Metrics.RESOLUTIONS]
+            seconds = min([span for span in spans if span >= integer("history")] or [max(spans)])
 
-                if "labels" in obj["metadata"]:
-                    node["labels"] = obj["metadata"]["labels"]
+            histories = {
+                obj["metadata"]["name"]: self.workers.submit(
+                    snapshot.get, ("metrics", obj["metadata"]["name"], seconds),
+                    functools.partial(self.metrics, f"{obj['metadata']['name']}.local", password, seconds)
+                )
+                for obj in objs
+            }
 
-                for condition in obj["status"]["conditions"]:
-                    if condition["type"] == "Ready" and condition["status"] == "True":
-                        node["status"] = "Ready"
+        (done, pending) = concurrent.futures.wait(list(statuses.values()) + list(histories.values()), timeout=self.deadline)
 
-                if node["name"] == platform.node():
-                    node["role"] = "master"
-                    master = node
-                else:
-                    node["role"] = "worker"
-                    workers.append(node)
+        if kube():
 
-            nodes.append(master)
+            for obj in objs:
 
-        if self.uninitialized():
+                node = self.compact(obj)
 
-            try:
+                data = self.result(statuses[node["name"]], done)
 
-                response = requests.get(
-                    "http://klot-io.local/api/status", timeout=5,
-                    headers={"x-klot-io-password": 'kloudofthings'}
-                )
+                if data:
+                    node["load"] = data["load"]
+                    node["free"] = data["free"]
+                    node["cpu"] = data.get("cpu")
+                    node["temperature"] = data.get("temperature")
 
-                if response.status_code != 200:
+                if node["name"] in histories:
+                    node["metrics"] = self.result(histories[node["name"]], done)
 
-                    response = requests.get(
-                        "http://klot-io.local/api/status", timeout=5,
-                        headers={"x-klot-io-password": flask.request.headers["x-klot-io-password"]}
-                    )
+                if node["role"] == "master":
+                    master = node
+                else:
+                    workers.append(node)
 
-                if response.status_code == 200:
+            nodes.append(master)
 
-                    data = response.json()
+        if None in statuses:
 
-                    nodes.append({
-                        "name": "klot-io",
-                        "status": data["status"],
-                        "role": None,
-                        "load": data["load"],
-                        "free": data["free"]
-                    })
+            data = self.result(statuses[None], done)
 
-            except:
+            if data:
 
-                pass
+                nodes.append({
+                    "name": "klot-io",
+                    "status": data["status"],
+                    "role": None,
+                    "load": data["load"],
+                    "free": data["free"]
+                })
 
         nodes.extend(sorted(workers, key=lambda node: node["name"]))
 
+        if histories:
+            return {"nodes": nodes, "metrics": self.aggregate([node["metrics"] for node in nodes if node and node.get("metrics")])}
+
         return {"nodes": nodes}
 
     @require_auth
@@ -494,6 +1382,7 @@ class Node(flask_restful.Resource):
         try:
 
             pykube.Node.objects(kube()).get(name=node).delete()
+            invalidate("Node")
 
             os.system(f"sudo sed -i '/{node}/d' /var/lib/rancher/k3s/server/cred/node-passwd")
 
@@ -531,61 +1420,180 @@ class Namespace(flask_restful.Resource):
 
 class Event(flask_restful.Resource):
 
+    @staticmethod
+    def compact(obj):
+
+        event = {
+            "kind": obj["involvedObject"]["kind"],
+            "name": obj["involvedObject"]["name"],
+            "reason": obj.get("reason"),
+            "message": obj.get("message"),
+            "timestamp": obj.get("lastTimestamp") or obj.get("eventTime") or obj["metadata"]["creationTimestamp"]
+        }
+
+        if "namespace" in obj["involvedObject"]:
+            event["namespace"] = obj["involvedObject"]["namespace"]
+
+        return event
+
     @require_auth
     @require_kube
     def get(self):
 
         events = []
 
-        namespace = flask.request.args["namespace"] if "namespace" in flask.request.args else pykube.all
+        listed = listing("Event")
 
-        for obj in [event.obj for event in pykube.Event.objects(kube()).filter(namespace=namespace)]:
+        since = flask.request.args.get("since")
+        limit = integer("limit")
 
-            event = {
-                "kind": obj["involvedObject"]["kind"],
-                "name": obj["involvedObject"]["name"],
-                "reason": obj["reason"],
-                "message": obj["message"],
-                "timestamp": obj["lastTimestamp"]
-            }
+        while True:
 
-            if "namespace" in obj["involvedObject"]:
-                event["namespace"] = obj["involvedObject"]["namespace"]
+            for obj in listed.get("items") or []:
+
+                event = self.compact(obj)
+
+                # RFC 3339 timestamps in UTC compare correctly as strings
+
+                if since and event["timestamp"] < since:
+                    continue
+
+                events.append(event)
+
+            # Kubernetes pages before since filters, so keep going until there's a page's worth
+            # or it runs out, else a short page with a continue looks like the end
+
+            if not since or limit is None or len(events) >= limit or not listed["metadata"].get("continue"):
+                break
 
-            events.append(event)
+            listed = listing("Event", listed["metadata"]["continue"])
 
-        return {"events": sorted(events, key=lambda event: event["timestamp"])}
+        return paged("events", sorted(events, key=lambda event: event["timestamp"]), listed)
 
 
 class Pod(flask_restful.Resource):
 
+    @staticmethod
+    def compact(obj):
+
+        pod = {
+            "namespace": obj["metadata"]["namespace"],
+            "name": obj["metadata"]["name"],
+            "status": obj["status"]["phase"],
+            "node": None,
+            "containers": [container["name"] for container in obj["spec"]["containers"]]
+        }
+
+        if "nodeName" in obj["spec"]:
+            pod["node"] = obj["spec"]["nodeName"]
+
+        return pod
+
     @require_auth
     @require_kube
     def get(self):
 
         pods = []
 
-        namespace = flask.request.args["namespace"] if "namespace" in flask.request.args else pykube.all
+        listed = listing("Pod")
 
-        for obj in [pod.obj for pod in pykube.Pod.objects(kube()).filter(namespace=namespace)]:
+        for obj in listed.get("items") or []:
+            pods.append(self.compact(obj))
 
-            pod = {
-                "namespace": obj["metadata"]["namespace"],
-                "name": obj["metadata"]["name"],
-                "status": obj["status"]["phase"],
-                "node": None,
-                "containers": [container["name"] for container in obj["spec"]["containers"]]
-            }
+        return paged("pods", sorted(pods, key=lambda pod: (pod["namespace"], pod["name"])), listed)
 
-            if "nodeName" in obj["spec"]:
-                pod["node"] = obj["spec"]["nodeName"]
 
-            pods.append(pod)
+class PodRD(flask_restful.Resource):
 
-        return {"pods": sorted(pods, key=lambda pod: (pod["namespace"], pod["name"]))}
+    # pykube.Pod.logs keyword and the Kubernetes query parameter it maps to
 
+    PARAMS = {
+        "tail_lines": "tailLines",
+        "since_seconds": "sinceSeconds",
+        "limit_bytes": "limitBytes"
+    }
 
-class PodRD(flask_restful.Resource):
+    @staticmethod
+    def stream(pod, container, query, lines, stop, responses):
+
+        def offer(line):
+
+            # Block while the client is behind, which in turn stops reading from Kubernetes,
+            # but give up once it's gone so nothing waits on a queue no one drains
+
+            while not stop.is_set():
+                try:
+                    lines.put((container, line), timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        try:
+
+            response = pod.api.get(**pod.api_kwargs(operation="log", params=dict(query, container=container), stream=True))
+            responses.append(response)
+            response.raise_for_status()
+
+            for line in response.iter_lines(decode_unicode=True):
+
+                offer(line)
+
+                if stop.is_set():
+                    break
+
+        except Exception as exception:
+
+            offer(f"error following log: {exception}")
+
+        finally:
+
+            offer(None)
+
+    def follow(self, pod, containers, params):
+
+        query = {"follow": "true", "timestamps": "true"}
+
+        for param, name in self.PARAMS.items():
+            if param in params:
+                query[name] = params[param]
+
+        lines = queue.Queue(maxsize=256)
+        stop = threading.Event()
+        responses = []
+
+        def events():
+
+            finished = 0
+
+            # Started here rather than up front, so a refused stream never leaves readers behind
+
+            for container in containers:
+                threading.Thread(target=self.stream, args=(pod, container, query, lines, stop, responses), daemon=True).start()
+
+            try:
+
+                while finished < len(containers):
+
+                    try:
+                        (container, line) = lines.get(timeout=15)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+                        continue
+
+                    if line is None:
+                        finished += 1
+                        continue
+
+                    yield f"data: {json.dumps({'container': container, 'line': line})}\n\n"
+
+            finally:
+
+                stop.set()
+
+                for response in responses:
+                    response.close()
+
+        return streaming(events())
 
     @require_auth
     @require_kube
@@ -597,19 +1605,25 @@ class PodRD(flask_restful.Resource):
 
         containers = [container["name"] for container in pod.obj["spec"]["containers"]]
 
+        if "container" in flask.request.args:
+            containers = [container for container in containers if container in flask.request.args.getlist("container")]
+
         params = {
             "timestamps": True,
             "tail_lines": 100
         }
 
-        if "tail_lines" in flask.request.args:
-            params["tail_lines"] = flask.request.args["tail_lines"]
+        for param in self.PARAMS:
+            if param in flask.request.args:
+                params[param] = integer(param)
+
+        if flask.request.args.get("follow") == "true":
+            return self.follow(pod, containers, params)
 
         log = {}
 
         for container in containers:
-            params["container"] = container
-            log[container] = pykube.Pod.objects(kube()).filter(namespace=namespace).get(name=name).logs(**params)
+            log[container] = pod.logs(container=container, **params)
 
         return {"log": log}
 
@@ -628,9 +1642,42 @@ class App(flask_restful.Resource):
 
     singular = "app"
     plural = "apps"
+    resources = store.Store()
 
-    @staticmethod
-    def to_dict(obj, short=False):
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    yamls = collections.OrderedDict()
+    lock = threading.Lock()
+
+    @classmethod
+    def render(cls, obj):
+
+        # An object's YAML can't change without its resourceVersion changing
+
+        key = (obj["metadata"]["name"], obj["metadata"].get("resourceVersion"))
+
+        with cls.lock:
+            if key[1] is not None and key in cls.yamls:
+                cls.yamls.move_to_end(key)
+                return cls.yamls[key]
+
+        display = dict(obj)
+
+        if isinstance(obj.get("resources"), str):
+            display["resources"] = cls.resources.get(obj["resources"]) or obj["resources"]
+
+        text = yaml.dump(display, Dumper=cls.dumper, default_flow_style=False)
+
+        with cls.lock:
+
+            cls.yamls[key] = text
+
+            while len(cls.yamls) > 64:
+                cls.yamls.popitem(last=False)
+
+        return text
+
+    @classmethod
+    def to_dict(cls, obj, short=False):
 
         app = {
             "name": obj["metadata"]["name"],
@@ -645,9 +1692,6 @@ class App(flask_restful.Resource):
         if "url" in obj:
             app["url"] = obj["url"]
 
-        if "settings" in obj:
-            app["settings"] = obj["settings"]
-
         if "settings" in obj.get("spec", {}) and app["status"] in ["NeedSettings", "Installed"]:
             app["actions"].append("Settings")
 
@@ -664,10 +1708,13 @@ class App(flask_restful.Resource):
 
         if not short:
 
+            if "settings" in obj:
+                app["settings"] = obj["settings"]
+
             if "error" in obj:
                 app["error"] = obj["error"]
 
-            app["yaml"] = yaml.safe_dump(obj, default_flow_style=False)
+            app["yaml"] = cls.render(obj)
 
         return app
 
@@ -675,15 +1722,10 @@ class AppLP(App):
 
     @require_auth
     @require_kube
+    @conditional
     def get(self):
 
-        apps = []
-
-        for obj in [app.obj for app in pykube.KlotIOApp.objects(kube()).filter()]:
-
-            apps.append(self.to_dict(obj, short=True))
-
-        return {self.plural: sorted(apps, key=lambda app: app["name"])}
+        return {self.plural: sorted(summaries(), key=lambda app: app["name"])}
 
     @require_auth
     @require_kube
@@ -708,6 +1750,7 @@ class AppLP(App):
             obj["action"] = flask.request.json["action"]
 
         pykube.KlotIOApp(kube(), obj).create()
+        invalidate("KlotIOApp")
 
         return {"message": f"{obj['metadata']['name']} queued"}, 202
 
@@ -889,13 +1932,15 @@ class AppRIU(App):
             return {"error": "missing action"}, 400
 
         obj = pykube.KlotIOApp.objects(kube()).filter().get(name=name).obj
+        original = copy.deepcopy(obj)
 
         obj["action"] = flask.request.json["action"]
 
         if "error" in obj:
             del obj["error"]
 
-        pykube.KlotIOApp(kube(), obj).replace()
+        store.save(kube(), original, obj)
+        invalidate("KlotIOApp")
 
         return {self.singular: self.to_dict(obj)}
 
@@ -922,6 +1967,7 @@ class AppRIU(App):
             return {"error": "missing config"}, 400
 
         obj = pykube.KlotIOApp.objects(kube()).filter().get(name=name).obj
+        original = copy.deepcopy(obj)
 
         fields = self.fields(obj, flask.request.json["values"])
 
@@ -938,28 +1984,31 @@ class AppRIU(App):
             label = f"{obj['metadata']['name']}/{field.name}"
 
             current = field.value if field.multi else [field.value]
-            original = field.original if field.multi else [field.original]
+            before = field.original if field.multi else [field.original]
 
             for value in current:
-                if value not in original:
+                if value not in before:
 
                     node = pykube.Node.objects(kube()).get(name=value).obj
                     node["metadata"]["labels"][label] = field.content["node"]
                     pykube.Node(kube(), node).replace()
+                    invalidate("Node")
 
                     if obj["status"] == "Installed":
                         obj["status"] = "Installing"
 
-            for value in original:
+            for value in before:
                 if value not in current:
                     node = pykube.Node.objects(kube()).get(name=value).obj
                     del node["metadata"]["labels"][label]
                     pykube.Node(kube(), node).replace()
+                    invalidate("Node")
 
         if obj["status"] == "NeedSettings":
             obj["status"] = "Installing"
 
-        pykube.KlotIOApp(kube(), obj).replace()
+        store.save(kube(), original, obj)
+        invalidate("KlotIOApp")
 
         try:
 
@@ -983,5 +2032,21 @@ class AppRIU(App):
             return {"error": f"Can't delete Installed {name}. Uninstall first."}
 
         pykube.KlotIOApp(kube(), obj).delete()
+        invalidate("KlotIOApp")
 
         return {"message": f"{name} deleted"}, 201
+
+
+class Stream(flask_restful.Resource):
+
+    @require_auth
+    @require_kube
+    def get(self):
+
+        feed = flask.current_app.feed
+        feed.start(kube())
+
+        version = feed.resume(flask.request.args.get("since"))
+        kinds = flask.request.args["kinds"].split(",") if "kinds" in flask.request.args else list(Feed.KINDS.values())
+
+        return streaming(feed.events(version, kinds))
@@ -1,63 +1,736 @@
 import os
 import time
 import yaml
-import socket
+import random
+import struct
+import asyncio
 import pykube
 import dnslib
 import dnslib.server
+import endpoint
+import threading
+import traceback
+import collections
+import concurrent.futures
+
+WATCHES = ["Node", "Service", "Pod"]
+
+class Cache(object):
+
+    def __init__(self, size=1024, ttl=3600, negative=900):
+
+        self.size = size
+        self.ttl = ttl
+        self.negative = negative
+
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(request):
+
+        return (str(request.q.qname).lower(), request.q.qtype, request.q.qclass)
+
+    def expires(self, reply):
+
+        if reply.header.tc:
+            return None
+
+        if reply.header.rcode == dnslib.RCODE.NXDOMAIN or (reply.header.rcode == dnslib.RCODE.NOERROR and not reply.rr):
+
+            # RFC 2308 - negative answers live for the lesser of the SOA's TTL and MINIMUM
+
+            for rr in reply.auth:
+                if rr.rtype == dnslib.QTYPE.SOA:
+                    return min(rr.ttl, rr.rdata.times[-1], self.negative)
+
+            return None
+
+        if reply.header.rcode != dnslib.RCODE.NOERROR:
+            return None
+
+        ttls = [rr.ttl for rr in reply.rr + reply.auth + reply.ar if rr.rtype != dnslib.QTYPE.OPT]
+
+        return min(ttls + [self.ttl])
+
+    def get(self, request):
+
+        key = self.key(request)
+        now = time.time()
+
+        with self.lock:
+
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] <= now:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        (expires, stored, packed) = entry
+
+        reply = dnslib.DNSRecord.parse(packed)
+        reply.header.id = request.header.id
+        reply.questions = request.questions
+
+        age = int(now - stored)
+
+        for rr in reply.rr + reply.auth + reply.ar:
+            if rr.rtype != dnslib.QTYPE.OPT:
+                rr.ttl = max(rr.ttl - age, 0)
+
+        return reply
+
+    def put(self, request, reply):
+
+        ttl = self.expires(reply)
+
+        if not ttl:
+            return
+
+        now = time.time()
+
+        with self.lock:
+
+            self.entries[self.key(request)] = (now + ttl, now, reply.pack())
+            self.entries.move_to_end(self.key(request))
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class Nameserver(object):
+
+    def __init__(self, address):
+
+        self.address = address
+        self.rtt = None
+        self.failures = 0
+        self.until = 0
+
+    def score(self):
+
+        return self.rtt if self.rtt is not None else 0.05
+
+    def stats(self):
+
+        return {"rtt": self.rtt, "failures": self.failures, "until": self.until}
+
+class Nameservers(object):
+
+    def __init__(self, weight=0.3, backoff=60):
+
+        self.weight = weight
+        self.backoff = backoff
+
+        self.lock = threading.Lock()
+        self.servers = collections.OrderedDict()
+
+    def update(self, addresses):
+
+        with self.lock:
+
+            servers = collections.OrderedDict()
+
+            for address in addresses:
+                servers[address] = self.servers.get(address) or Nameserver(address)
+
+            self.servers = servers
+
+    def ranked(self):
+
+        now = time.time()
+
+        with self.lock:
+
+            healthy = [server for server in self.servers.values() if server.until <= now]
+            backoff = [server for server in self.servers.values() if server.until > now]
+
+        return sorted(healthy, key=Nameserver.score) + sorted(backoff, key=lambda server: server.until)
+
+    def success(self, server, rtt):
+
+        with self.lock:
+
+            server.rtt = rtt if server.rtt is None else (1 - self.weight) * server.rtt + self.weight * rtt
+            server.failures = 0
+            server.until = 0
+
+    def failure(self, server):
+
+        with self.lock:
+
+            server.failures += 1
+            server.until = time.time() + min(2 ** server.failures, self.backoff)
+
+    def stats(self):
+
+        with self.lock:
+            return {address: server.stats() for address, server in self.servers.items()}
 
 class KlotIOResolver():
 
-    def __init__(self, daemon):
+    TTL = 15
+
+    def __init__(self, daemon, executor=None):
 
         self.daemon = daemon
+        self.executor = executor
 
-    def a_rr(self, host, ip):
+    @classmethod
+    def a_rr(cls, host, ip):
 
-        return dnslib.RR.fromZone(f"{host}. 15 A {ip}.")
+        return dnslib.RR(host, dnslib.QTYPE.A, rdata=dnslib.A(ip), ttl=cls.TTL)
 
-    def cname_rr(self, host, alias):
+    @classmethod
+    def cname_rr(cls, host, alias):
 
-        return dnslib.RR.fromZone(f"{host}. 15 CNAME {alias}.")
+        return dnslib.RR(host, dnslib.QTYPE.CNAME, rdata=dnslib.CNAME(alias), ttl=cls.TTL)
 
-    def resolve(self, request, handler):
+    @classmethod
+    def soa_rr(cls):
 
-        reply = request.reply()
+        return dnslib.RR("local", dnslib.QTYPE.SOA, ttl=cls.TTL, rdata=dnslib.SOA(
+            "klot-io.local", "hostmaster.klot-io.local", (int(time.time()), 3600, 600, 86400, cls.TTL)
+        ))
+
+    @classmethod
+    def compile(cls, ips, aliases):
+
+        # Each name maps qtype to its answers, with None holding what to answer (plus SOA) for anything else
+
+        records = {}
+
+        for host, ip in ips.items():
+            if host and ip:
+                a = cls.a_rr(host, ip)
+                records[dnslib.DNSLabel(host.lower()).label] = {
+                    dnslib.QTYPE.A: [a],
+                    dnslib.QTYPE.ANY: [a],
+                    None: []
+                }
+
+        for host, alias in aliases.items():
+            cname = cls.cname_rr(host, alias)
+            answers = [cname, cls.a_rr(alias, ips[alias])] if ips.get(alias) else [cname]
+            records[dnslib.DNSLabel(host.lower()).label] = {
+                dnslib.QTYPE.A: answers,
+                dnslib.QTYPE.CNAME: [cname],
+                dnslib.QTYPE.ANY: answers,
+                None: [cname]
+            }
+
+        return records
+
+    def answer(self, question, reply):
 
-        fqdn = '.'.join([piece.decode('utf-8') for piece in request.questions[0].qname.label])
+        entry = self.daemon.records.get(question.qname.label)
 
-        if fqdn in self.daemon.ips:
-            reply.add_answer(*self.a_rr(fqdn, self.daemon.ips[fqdn]))
-        elif fqdn in self.daemon.aliases:
-            reply.add_answer(*self.cname_rr(fqdn, self.daemon.aliases[fqdn]))
-            reply.add_answer(*self.a_rr(self.daemon.aliases[fqdn], self.daemon.ips[self.daemon.aliases[fqdn]]))
+        if entry is None:
+            entry = self.daemon.records.get(tuple(piece.lower() for piece in question.qname.label))
+
+        if entry is None or question.qclass != dnslib.CLASS.IN:
+            return False
+
+        answers = entry.get(question.qtype)
+
+        if answers is not None:
+            reply.add_answer(*answers)
         else:
+            reply.add_answer(*entry[None])
+            if not reply.auth:
+                reply.add_auth(self.daemon.soa)
+
+        return True
+
+    def local(self, request):
+
+        reply = request.reply()
+        reply.questions = request.questions
+
+        remote = [question for question in request.questions if not self.answer(question, reply)]
+
+        return reply, remote
+
+    @staticmethod
+    def split(request, question):
+
+        return dnslib.DNSRecord(dnslib.DNSHeader(id=request.header.id, rd=request.header.rd), q=question)
+
+    @staticmethod
+    def merge(reply, remote):
+
+        reply.add_answer(*remote.rr)
+        reply.add_auth(*remote.auth)
+        reply.add_ar(*[rr for rr in remote.ar if rr.rtype != dnslib.QTYPE.OPT])
+
+        # NXDOMAIN is only about that one question, the others may well have answers
+
+        if remote.header.rcode not in (dnslib.RCODE.NOERROR, dnslib.RCODE.NXDOMAIN) and not reply.header.rcode:
+            reply.header.rcode = remote.header.rcode
+
+    def query(self, server, request, tcp, timeout):
+
+        start = time.time()
+
+        try:
+            response = request.send(server.address, 53, tcp=tcp, timeout=timeout)
+        except OSError:
+            self.daemon.nameservers.failure(server)
+            raise
+
+        self.daemon.nameservers.success(server, time.time() - start)
+
+        return response
+
+    def race(self, servers, request, tcp, timeout):
+
+        queries = [self.executor.submit(self.query, server, request, tcp, timeout) for server in servers]
+
+        try:
+            for query in concurrent.futures.as_completed(queries, timeout):
+                if query.exception() is None:
+                    return query.result()
+        except concurrent.futures.TimeoutError:
+            pass
+
+        return None
+
+    def forward(self, request, tcp):
+
+        reply = self.daemon.cache.get(request)
+
+        if reply is not None:
+            return reply
+
+        reply = request.reply()
+        reply.header.rcode = getattr(dnslib.RCODE, 'NXDOMAIN')
+
+        deadline = time.time() + self.daemon.settings.get("timeout", 5)
+        attempt = self.daemon.settings.get("attempt", 2)
+        servers = self.daemon.nameservers.ranked()
+
+        response = None
+
+        if self.daemon.settings.get("race") and len(servers) > 1:
+            response = self.race(servers[:2], request, tcp, attempt)
+            servers = servers[2:]
+
+        for server in servers:
+
+            if response is not None:
+                break
+
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                break
+
             try:
-                reply = dnslib.DNSRecord.parse(request.send(self.daemon.upstream, 53, tcp=(handler.protocol != 'udp'), timeout=5))
-            except socket.timeout:
-                reply.header.rcode = getattr(dnslib.RCODE, 'NXDOMAIN')
+                response = self.query(server, request, tcp, min(remaining, attempt))
+            except OSError:
+                continue
+
+        if response is not None:
+            reply = dnslib.DNSRecord.parse(response)
+            self.daemon.cache.put(request, reply)
 
         return reply
 
+    def resolve(self, request, handler):
+
+        (reply, remote) = self.local(request)
+
+        tcp = handler.protocol != 'udp'
+
+        if len(request.questions) == 1 and remote:
+            return self.forward(request, tcp)
+
+        for question in remote:
+            self.merge(reply, self.forward(self.split(request, question), tcp))
+
+        return reply
+
+class Upstream(asyncio.DatagramProtocol):
+
+    def __init__(self):
+
+        self.transport = None
+        self.pending = {}
+        self.closed = False
+
+    def connection_made(self, transport):
+
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+
+        if len(data) < 2:
+            return
+
+        future = self.pending.pop(struct.unpack("!H", data[:2])[0], None)
+
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+
+        print(f"upstream error: {exc}")
+
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+        self.pending = {}
+
+    def connection_lost(self, exc):
+
+        self.closed = True
+
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("upstream socket closed"))
+
+        self.pending = {}
+
+    def send(self, data):
+
+        ident = random.randrange(65536)
+
+        while ident in self.pending:
+            ident = random.randrange(65536)
+
+        future = asyncio.get_event_loop().create_future()
+        self.pending[ident] = future
+
+        self.transport.sendto(struct.pack("!H", ident) + data[2:])
+
+        return ident, future
+
+class Forwarder(object):
+
+    def __init__(self, daemon, sockets=4, port=53):
+
+        self.daemon = daemon
+        self.sockets = sockets
+        self.timeout = daemon.settings.get("timeout", 5)
+        self.port = port
+
+        self.pools = {}
+        self.turn = 0
+        self.inflight = {}
+        self.lock = asyncio.Lock()
+
+    async def upstream(self, server):
+
+        async with self.lock:
+
+            pool = [protocol for protocol in self.pools.get(server, []) if not protocol.closed]
+
+            if len(pool) < self.sockets:
+                (transport, protocol) = await asyncio.get_event_loop().create_datagram_endpoint(
+                    Upstream, remote_addr=(server, self.port)
+                )
+                pool.append(protocol)
+
+            self.pools[server] = pool
+
+            self.turn = (self.turn + 1) % len(pool)
+
+            return pool[self.turn]
+
+    async def udp(self, server, data):
+
+        protocol = await self.upstream(server)
+
+        (ident, future) = protocol.send(data)
+
+        try:
+            response = await asyncio.wait_for(future, self.daemon.settings.get("attempt", 2))
+        finally:
+            protocol.pending.pop(ident, None)
+
+        return data[:2] + response[2:]
+
+    async def tcp(self, server, data):
+
+        (reader, writer) = await asyncio.wait_for(asyncio.open_connection(server, self.port), self.timeout)
+
+        try:
+            writer.write(struct.pack("!H", len(data)) + data)
+            length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+            return await asyncio.wait_for(reader.readexactly(length), self.timeout)
+        finally:
+            writer.close()
+
+    async def attempt(self, server, data, tcp):
+
+        start = time.time()
+
+        try:
+
+            response = await self.udp(server.address, data)
+
+            if tcp and dnslib.DNSHeader.parse(dnslib.DNSBuffer(response)).tc:
+                response = await self.tcp(server.address, data)
+
+        except (asyncio.TimeoutError, OSError):
+
+            self.daemon.nameservers.failure(server)
+            raise
+
+        self.daemon.nameservers.success(server, time.time() - start)
+
+        return response
+
+    @staticmethod
+    def settle(future):
+
+        if not future.cancelled():
+            future.exception()
+
+    async def race(self, servers, data, tcp):
+
+        attempts = [asyncio.ensure_future(self.attempt(server, data, tcp)) for server in servers]
+
+        for attempt in attempts:
+            attempt.add_done_callback(self.settle)
+
+        for attempt in asyncio.as_completed(attempts):
+            try:
+                return await attempt
+            except (asyncio.TimeoutError, OSError):
+                continue
+
+        return None
+
+    async def fetch(self, request, tcp):
+
+        data = request.pack()
+        servers = self.daemon.nameservers.ranked()
+
+        response = None
+
+        if self.daemon.settings.get("race") and len(servers) > 1:
+            response = await self.race(servers[:2], data, tcp)
+            servers = servers[2:]
+
+        for server in servers:
+
+            if response is not None:
+                break
+
+            try:
+                response = await self.attempt(server, data, tcp)
+            except (asyncio.TimeoutError, OSError):
+                continue
+
+        if response is None:
+            raise asyncio.TimeoutError("no upstream answered")
+
+        self.daemon.cache.put(request, dnslib.DNSRecord.parse(response))
+
+        return response
+
+    def done(self, key, future):
+
+        self.inflight.pop(key, None)
+
+        if not future.cancelled() and future.exception() is not None:
+            print(f"forward {key} failed: {future.exception()!r}")
+
+    async def forward(self, request, tcp=False):
+
+        key = Cache.key(request) + (tcp,)
+
+        future = self.inflight.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(self.fetch(request, tcp))
+            self.inflight[key] = future
+            future.add_done_callback(lambda done: self.done(key, done))
+
+        response = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+        reply = dnslib.DNSRecord.parse(response)
+        reply.header.id = request.header.id
+        reply.questions = request.questions
+
+        return reply
+
+class Listener(asyncio.DatagramProtocol):
+
+    def __init__(self, server):
+
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+
+        asyncio.ensure_future(self.respond(data, addr))
+
+    async def respond(self, data, addr):
+
+        reply = await self.server.handle(data, tcp=False)
+
+        if reply is not None:
+            self.transport.sendto(reply.pack(), addr)
+
+class Server(object):
+
+    def __init__(self, daemon, address="0.0.0.0", port=53, idle=10):
+
+        self.daemon = daemon
+        self.address = address
+        self.port = port
+        self.idle = idle
+
+        self.resolver = KlotIOResolver(daemon)
+        self.forwarder = Forwarder(daemon)
+
+    async def handle(self, data, tcp):
+
+        try:
+            request = dnslib.DNSRecord.parse(data)
+        except dnslib.DNSError as exception:
+            print(f"invalid request: {exception}")
+            return None
+
+        (reply, remote) = self.resolver.local(request)
+
+        if len(request.questions) == 1 and remote:
+            return await self.forward(request, tcp)
+
+        for question in remote:
+            self.resolver.merge(reply, await self.forward(self.resolver.split(request, question), tcp))
+
+        return reply
+
+    async def forward(self, request, tcp):
+
+        reply = self.daemon.cache.get(request)
+
+        if reply is not None:
+            return reply
+
+        try:
+
+            reply = await self.forwarder.forward(request, tcp)
+
+        except (asyncio.TimeoutError, OSError):
+
+            reply = request.reply()
+            reply.header.rcode = getattr(dnslib.RCODE, 'NXDOMAIN')
+
+        except Exception:
+
+            traceback.print_exc()
+
+            reply = request.reply()
+            reply.header.rcode = getattr(dnslib.RCODE, 'SERVFAIL')
+
+        return reply
+
+    async def client(self, reader, writer):
+
+        try:
+
+            while True:
+
+                length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), self.idle))[0]
+                reply = await self.handle(await asyncio.wait_for(reader.readexactly(length), self.idle), tcp=True)
+
+                if reply is None:
+                    break
+
+                packed = reply.pack()
+                writer.write(struct.pack("!H", len(packed)) + packed)
+                await writer.drain()
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+
+            pass
+
+        finally:
+
+            writer.close()
+
+    def run(self):
+
+        loop = asyncio.get_event_loop()
+
+        loop.run_until_complete(loop.create_datagram_endpoint(
+            lambda: Listener(self), local_addr=(self.address, self.port)
+        ))
+        loop.run_until_complete(asyncio.start_server(self.client, self.address, self.port))
+
+        loop.run_forever()
+
 class Daemon(object):
 
     def __init__(self):
 
+        self.lock = threading.RLock()
+        self.cache = Cache()
+        self.nameservers = Nameservers()
+        self.settings = {}
+
+        # Engine and upstream tuning, documented under DNS in Development.md and only read here
+
+        if os.path.exists("/opt/klot-io/config/dns.yaml"):
+            with open("/opt/klot-io/config/dns.yaml", "r") as yaml_file:
+                self.settings = yaml.safe_load(yaml_file) or {}
+
         self.clear()
 
     def recurse(self):
 
+        upstreams = []
+
         with open("/etc/resolv.conf", "r") as resolv_file:
             for resolv_line in resolv_file:
-                if "nameserver" in resolv_line:
-                    self.upstream = resolv_line.split(' ')[-1].strip()
+                if resolv_line.strip().startswith("nameserver"):
+                    upstreams.append(resolv_line.split(' ')[-1].strip())
+
+        for upstream in self.settings.get("upstreams", []):
+            if upstream not in upstreams:
+                upstreams.append(upstream)
+
+        self.nameservers.update(upstreams)
 
     def clear(self):
 
-        self.ips = {}
-        self.aliases = {}
-        self.cluster = None
-        self.kube = None
+        with self.lock:
+
+            self.ips = {}
+            self.aliases = {}
+            self.records = {}
+            self.soa = KlotIOResolver.soa_rr()
+            self.cluster = None
+            self.kube = None
+
+            self.watches = {}
+            self.hosts = {}
+            self.index = endpoint.Index()
+
         self.recurse()
 
     def config(self):
@@ -78,86 +751,98 @@ class Daemon(object):
 
         return True
 
-    def nodes(self):
+    @staticmethod
+    def node(obj):
 
-        ips = {}
+        ip = None
+        host = None
 
-        for node in [node.obj for node in pykube.Node.objects(self.kube).filter()]:
+        for address in obj["status"]["addresses"]:
+            if address["type"] == "InternalIP":
+                ip = address["address"]
+            elif address["type"] == "Hostname":
+                host = f"{address['address']}.local"
 
-            ip = None
-            host = None
+        return (host, ip)
 
-            for address in node["status"]["addresses"]:
-                if address["type"] == "InternalIP":
-                    ip = address["address"]
-                elif address["type"] == "Hostname":
-                    host = f"{address['address']}.local"
+    def publish(self):
 
-            ips[host] = ip
+        self.ips = dict(self.hosts.values())
+        self.aliases = {
+            f"{name}-{namespace}-{self.cluster}-klot-io.local": f"{sorted(node_ips.keys())[0]}.local"
+            for (namespace, name), node_ips in self.index.endpoints.items()
+        }
+        self.records = KlotIOResolver.compile(self.ips, self.aliases)
+        self.soa = KlotIOResolver.soa_rr()
 
-        return ips
+    def relist(self, kube, kind, objs):
 
-    def services(self):
+        with self.lock:
 
-        aliases = {}
+            if self.kube is not kube:
+                return
 
-        for service in [service.obj for service in pykube.Service.objects(self.kube).filter(namespace=pykube.all)]:
+            if kind == "Node":
+                self.hosts = {obj["metadata"]["name"]: self.node(obj) for obj in objs}
+            else:
+                self.index.relist(kind, objs)
 
-            if (
-                "type" not in service["spec"] or service["spec"]["type"] != "LoadBalancer" or
-                "ports" not in service["spec"] or "selector" not in service["spec"] or
-                "namespace" not in service["metadata"]
-            ):
-                continue
+            self.publish()
 
-            name = service["metadata"]["name"]
-            namespace = service["metadata"]["namespace"]
+    def event(self, kube, kind, action, obj):
 
-            servers = False
+        with self.lock:
 
-            for port in service["spec"]["ports"]:
+            if self.kube is not kube:
+                return
 
-                if "name" not in port:
-                    continue
+            if kind == "Node":
 
-                if port["name"].lower().startswith("http"):
-                    servers = True
+                if action == "DELETED":
+                    self.hosts.pop(obj["metadata"]["name"], None)
+                else:
+                    self.hosts[obj["metadata"]["name"]] = self.node(obj)
 
-            if not servers:
-                continue
+            elif not self.index.event(kind, action, obj):
 
-            nodes = []
+                return
 
-            for pod in [pod.obj for pod in pykube.Pod.objects(self.kube).filter(
-                namespace=service["metadata"]["namespace"],
-                selector=service["spec"]["selector"]
-            )]:
-                if "nodeName" in pod["spec"] and "podIP" in pod["status"]:
-                    nodes.append(pod["spec"]["nodeName"])
+            self.publish()
 
-            if not nodes:
-                continue
+    def watch(self):
 
-            node = f"{sorted(nodes)[0]}.local"
-            host = f"{name}-{namespace}-{self.cluster}-klot-io.local"
+        for kind in WATCHES:
+            if kind not in self.watches or not self.watches[kind].thread.is_alive():
+                self.watches[kind] = endpoint.Watch(self, kind)
 
-            aliases[host] = node
+    def maintain(self):
 
-        return aliases
+        report = time.time()
 
-    def process(self):
+        while True:
+
+            if self.config():
+                self.watch()
 
-        if self.config():
-            self.ips = self.nodes()
-            self.aliases = self.services()
+            if time.time() > report:
+                print(f"cache {self.cache.stats()}")
+                print(f"upstreams {self.nameservers.stats()}")
+                report = time.time() + 300
+
+            time.sleep(10)
 
     def run(self):
 
-        resolver = KlotIOResolver(self)
-        logger = dnslib.server.DNSLogger(prefix=False)
-        server = dnslib.server.DNSServer(resolver,port=53,address="0.0.0.0",logger=logger)
-        server.start_thread()
+        if self.settings.get("engine") == "asyncio":
 
-        while True:
-            self.process()
-            time.sleep(10)
\ No newline at end of file
+            threading.Thread(target=self.maintain, daemon=True).start()
+            Server(self).run()
+
+        else:
+
+            resolver = KlotIOResolver(self, concurrent.futures.ThreadPoolExecutor(max_workers=8))
+            logger = dnslib.server.DNSLogger(prefix=False)
+            server = dnslib.server.DNSServer(resolver,port=53,address="0.0.0.0",logger=logger)
+            server.start_thread()
+
+            self.maintain()
@@ -0,0 +1,24 @@
+# Gunicorn settings for klot-io-api, loaded by bin/api.py
+#
+# A single worker process, because the API keeps its state per process: metrics history,
+# the snapshot cache, the stream feed and its watches, and the app.kube client. Requests
+# are handled on threads within that worker, so a slow node fan-out, followed log or
+# stream only ties up its own thread. Streams are capped at manage.app's streams, 16,
+# so the other 8 threads are always free for /health, /status, /node and the rest.
+
+bind = "0.0.0.0:8083"
+
+workers = 1
+worker_class = "gthread"
+threads = 24
+
+# Longer than nginx holds idle upstream connections, so nginx is always the one to close
+
+keepalive = 75
+
+timeout = 60
+
+# On HUP (systemctl reload) the new worker imports the updated code and the old one
+# gets this long to finish its requests, streams reconnect on their own
+
+graceful_timeout = 10
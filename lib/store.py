@@ -0,0 +1,100 @@
+import os
+import json
+import pykube
+import hashlib
+import threading
+
+class Store(object):
+
+    # Content addressed so an app only carries a digest and identical downloads share a file
+
+    def __init__(self, path="/opt/klot-io/cache/resources"):
+
+        self.path = path
+
+    def locate(self, digest):
+
+        return f"{self.path}/{digest.split(':')[-1]}.json"
+
+    def put(self, resources):
+
+        content = json.dumps(resources, sort_keys=True)
+        digest = f"sha256:{hashlib.sha256(content.encode('utf-8')).hexdigest()}"
+        path = self.locate(digest)
+
+        if not os.path.exists(path):
+
+            os.makedirs(self.path, exist_ok=True)
+
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+
+            with open(temporary, "w") as store_file:
+                store_file.write(content)
+
+            os.rename(temporary, path)
+
+        return digest
+
+    def get(self, digest):
+
+        path = self.locate(digest)
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r") as store_file:
+            return json.load(store_file)
+
+
+def changes(original, current):
+
+    patch = {}
+
+    for key in set(original) | set(current):
+
+        if key not in current:
+            patch[key] = None
+        elif key not in original:
+            patch[key] = current[key]
+        elif isinstance(original[key], dict) and isinstance(current[key], dict):
+            nested = changes(original[key], current[key])
+            if nested:
+                patch[key] = nested
+        elif original[key] != current[key]:
+            patch[key] = current[key]
+
+    return patch
+
+
+def save(kube, original, obj):
+
+    patch = changes(original, obj)
+    app = pykube.KlotIOApp(kube, obj)
+
+    status = {"status": patch.pop("status")} if "status" in patch else None
+
+    # Status goes through its subresource, unless the CRD predates it
+
+    if status is not None:
+
+        response = kube.patch(**app.api_kwargs(
+            operation="status",
+            headers={"Content-Type": "application/merge-patch+json"},
+            data=json.dumps(status)
+        ))
+
+        if response.status_code == 404:
+            patch.update(status)
+        else:
+            kube.raise_for_status(response)
+            obj["metadata"]["resourceVersion"] = response.json()["metadata"]["resourceVersion"]
+
+    if patch:
+
+        response = kube.patch(**app.api_kwargs(
+            headers={"Content-Type": "application/merge-patch+json"},
+            data=json.dumps(patch)
+        ))
+
+        kube.raise_for_status(response)
+        obj["metadata"]["resourceVersion"] = response.json()["metadata"]["resourceVersion"]
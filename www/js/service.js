@@ -24,14 +24,110 @@ DRApp.STATUSES = {
 
 DRApp.status =  "Login";
 
+// Kubernetes state pushed from /api/stream, kept as kind -> key -> item and patched with each diff
+
+DRApp.store = {
+    data: {},
+    version: null,
+    request: null,
+    received: 0,
+    failures: 0,
+    changed: null,
+    open: function() {
+        if (this.request) {
+            return;
+        }
+        var store = this;
+        var request = new XMLHttpRequest();
+        request.open("GET", "/api/stream" + ((this.version !== null) ? "?since=" + encodeURIComponent(this.version) : ""));
+        request.setRequestHeader("x-klot-io-password", DRApp.password);
+        request.onprogress = function() {
+            store.receive(request);
+        };
+        request.onloadend = function() {
+            store.receive(request);
+            store.request = null;
+            // The server closes streams every few minutes, so reconnect right away. A restart or reload
+            // cuts it off with no status, so back off and keep trying unless the password was refused.
+            if (request.status == 200) {
+                store.failures = 0;
+                store.open();
+            } else if (request.status != 401 && request.status != 403) {
+                store.failures += 1;
+                window.setTimeout($.proxy(store.open,store), Math.min(1000 * Math.pow(2, store.failures - 1), 30000));
+            }
+        };
+        this.request = request;
+        this.received = 0;
+        request.send();
+    },
+    receive: function(request) {
+        var end = request.responseText.lastIndexOf("\n\n");
+        if (end < this.received) {
+            return;
+        }
+        var frames = request.responseText.substring(this.received, end).split("\n\n");
+        this.received = end + 2;
+        var changed = {};
+        for (var frame_index = 0; frame_index < frames.length; frame_index++) {
+            var lines = frames[frame_index].split("\n");
+            for (var line_index = 0; line_index < lines.length; line_index++) {
+                if (lines[line_index].indexOf("data: ") == 0) {
+                    this.apply(JSON.parse(lines[line_index].substring(6)), changed);
+                }
+            }
+        }
+        if (this.changed && !$.isEmptyObject(changed)) {
+            this.changed(changed);
+        }
+    },
+    apply: function(change, changed) {
+        if (change.reset) {
+            for (var kind in change.reset) {
+                this.data[kind] = change.reset[kind];
+                changed[kind] = true;
+            }
+        } else {
+            var items = this.data[change.kind] = this.data[change.kind] || {};
+            for (var key in change.upsert) {
+                items[key] = change.upsert[key];
+            }
+            for (var delete_index = 0; delete_index < change.delete.length; delete_index++) {
+                delete items[change.delete[delete_index]];
+            }
+            changed[change.kind] = true;
+        }
+        this.version = change.version;
+    },
+    list: function(kind, keep, fields) {
+        var items = [];
+        for (var key in this.data[kind]) {
+            if (keep(this.data[kind][key])) {
+                items.push(this.data[kind][key]);
+            }
+        }
+        items.sort(function(a, b) {
+            for (var field_index = 0; field_index < fields.length; field_index++) {
+                var field = fields[field_index];
+                if (a[field] != b[field]) {
+                    return (a[field] < b[field]) ? -1 : 1;
+                }
+            }
+            return 0;
+        });
+        return items;
+    }
+};
+
 DRApp.controller("Base",null,{
     timeout: null,
+    redrawing: null,
     loading: function() {
         $("#spinner").show();
     },
-    start: function() {
+    start: function(delay) {
         this.stop();
-        this.timeout = window.setTimeout($.proxy(this.update,this), 10000);
+        this.timeout = window.setTimeout($.proxy(this.update,this), delay || 10000);
     },
     update: function() {
         if (!$("#name").is(":focus")) {
@@ -44,6 +140,38 @@ DRApp.controller("Base",null,{
         if (this.timeout) {
             window.clearTimeout(this.timeout);
         }
+        if (this.redrawing) {
+            window.clearTimeout(this.redrawing);
+            this.redrawing = null;
+        }
+        DRApp.store.changed = null;
+    },
+    watch: function(kinds, redraw, delay) {
+        var controller = this;
+        // Pushes cover the page itself, this just picks up status changes for the header
+        this.start(delay || 60000);
+        DRApp.store.changed = function(changed) {
+            for (var kind_index = 0; kind_index < kinds.length; kind_index++) {
+                if (changed[kinds[kind_index]]) {
+                    controller.redraw(redraw);
+                    return;
+                }
+            }
+        };
+        DRApp.store.open();
+    },
+    redraw: function(redraw) {
+        if (this.redrawing) {
+            return;
+        }
+        this.redrawing = window.setTimeout($.proxy(function() {
+            this.redrawing = null;
+            if ($("#name").is(":focus")) {
+                this.redraw(redraw);
+            } else {
+                redraw.call(this);
+            }
+        },this), 100);
     },
     rest: function(type,url,data) {
         var response = $.ajax({
@@ -90,7 +218,7 @@ DRApp.controller("Base",null,{
                 apps: this.rest("GET","/api/app").apps
             }
             this.application.render(this.it);
-            this.start();
+            this.watch(["apps"], this.apps_redraw);
         }
     },
     login: function() {
@@ -115,9 +243,19 @@ DRApp.controller("Base",null,{
     logs: function() {
         this.loading();
         this.update_status();
-        this.it = {
-            lines: this.rest("GET","/api/log/" + this.application.current.path.service).lines
-        };
+        var service = this.application.current.path.service;
+        if (this.it && this.it.service == service && this.it.cursor) {
+            var log = this.rest("GET","/api/log/" + service + "?cursor=" + encodeURIComponent(this.it.cursor));
+            this.it.lines = this.it.lines.concat(log.lines).slice(-1000);
+            this.it.cursor = log.cursor;
+        } else {
+            var log = this.rest("GET","/api/log/" + service);
+            this.it = {
+                service: service,
+                lines: log.lines,
+                cursor: log.cursor
+            };
+        }
         this.application.render(this.it);
         this.start();
     },
@@ -133,7 +271,14 @@ DRApp.controller("Base",null,{
             this.it.events = this.rest("GET","/api/event").events;
         }
         this.application.render(this.it);
-        this.start();
+        this.watch(["events"], this.events_redraw);
+    },
+    events_redraw: function() {
+        var namespace = this.application.current.query.namespace;
+        this.it.events = DRApp.store.list("events", function(event) {
+            return !namespace || event.namespace == namespace;
+        }, ["timestamp"]);
+        this.application.render(this.it);
     },
     config: function() {
         this.update_status();
@@ -210,7 +355,12 @@ DRApp.controller("Base",null,{
             nodes: this.rest("GET","/api/node").nodes
         }
         this.application.render(this.it);
-        this.start();
+        // Load and memory come from each node rather than Kubernetes, so keep polling for those
+        this.watch(["nodes"], this.nodes_redraw, 10000);
+    },
+    nodes_redraw: function() {
+        this.it.nodes = this.rest("GET","/api/node").nodes;
+        this.application.render(this.it);
     },
     node_join: function() {
         this.loading();
@@ -241,7 +391,14 @@ DRApp.controller("Base",null,{
             this.it.pods = this.rest("GET","/api/pod").pods;
         }
         this.application.render(this.it);
-        this.start();
+        this.watch(["pods"], this.pods_redraw);
+    },
+    pods_redraw: function() {
+        var namespace = this.application.current.query.namespace;
+        this.it.pods = DRApp.store.list("pods", function(pod) {
+            return !namespace || pod.namespace == namespace;
+        }, ["namespace", "name"]);
+        this.application.render(this.it);
     },
     pod: function() {
         this.loading();
@@ -265,7 +422,13 @@ DRApp.controller("Base",null,{
             apps: this.rest("GET","/api/app").apps
         }
         this.application.render(this.it);
-        this.start();
+        this.watch(["apps"], this.apps_redraw);
+    },
+    apps_redraw: function() {
+        this.it.apps = DRApp.store.list("apps", function(app) {
+            return true;
+        }, ["name"]);
+        this.application.render(this.it);
     },
     apps_change: function() {
         this.stop();
@@ -411,7 +574,7 @@ DRApp.template("Apps",DRApp.load("apps"),null,DRApp.partials);
 DRApp.template("Info",DRApp.load("info"),null,DRApp.partials);
 DRApp.template("Settings",DRApp.load("settings"),null,DRApp.partials);
 
-DRApp.route("home","/","Home","Base", "home")
+DRApp.route("home","/","Home","Base", "home", "stop")
 DRApp.route("login","/login","Login","Base", "login")
 DRApp.route("logout","/logout","Login","Base", "logout")
 DRApp.route("logs","/log/{service}","Logs","Base", "logs", "stop")